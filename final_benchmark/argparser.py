@@ -8,6 +8,8 @@ def cl_parse():
         parser.add_argument('-core', type=int, required=False, default=0, help='Number of cores to use (only needed on Multi mode)')
         parser.add_argument('-mode', required=False, default='Single', help='Select "SingleCore" or "MultiCore" mode')
         parser.add_argument('-cnum', required=False, help='Select specific core')
+        parser.add_argument('-budget', type=int, required=False, default=4096, help='Memory budget for the Contact objects of one structure in MB: structures whose contacts would exceed it are processed in slabs and their contacts written to disk (the parsed structure itself is always held in memory and not counted)')
+        parser.add_argument('-out', required=False, default='.', help='Folder for the contacts of the structures processed in slabs')
 
         args = parser.parse_args()
 
@@ -18,6 +20,10 @@ def cl_parse():
         if mode not in modes:
             raise ValueError("Invalid Mode!")
         cnum = args.cnum
+        budget = args.budget * 1024 ** 2
+        if budget <= 0:
+            raise ValueError("Invalid memory budget!")
+        out = args.out
         
     except ArgumentError as e:
         print(f"Argument Error: {str(e)}")
@@ -31,7 +37,7 @@ def cl_parse():
         print(f"An unexpected error occurred: {str(e)}")
         exit(1)
     
-    return pdb_files, core, mode, cnum
+    return pdb_files, core, mode, cnum, budget, out
         
 def validate_file(value):
     if value.endswith('.pdb') or value.endswith('.pdbx') or value.endswith('.cif'):
@@ -1,5 +1,11 @@
+# usage: python biopython_optimized.py <folder> <core> [budget]
+# budget: memory for the interactions of one structure, in MB (4096 by default); the interactions of larger
+# structures are written to <name>_contacts.tsv as they are found (the structure, its atoms and the
+# NeighborSearch tree are still loaded whole)
 from Bio.PDB import MMCIFParser, NeighborSearch, PDBParser, is_aa
 import conditions_biop
+from contacts import residue_bytes
+from contextlib import nullcontext
 from timeit import default_timer as timer
 import os
 import sys
@@ -13,6 +19,7 @@ print(f"Running on core {core_id}")
 global_start = timer()
 
 folder = sys.argv[1]
+budget = int(sys.argv[3]) * 1024 ** 2 if len(sys.argv) > 3 else 4096 * 1024 ** 2
 
 files = []
 for entry in os.scandir(folder):
@@ -31,50 +38,55 @@ for file in files:
         continue
     
     protein_size = sum(1 for _ in structure.get_residues() if is_aa(_))
-    if protein_size > 5000:
-        print(f"Skipping ID '{file}'. Size: {protein_size} residues")
-        continue
+    # structures whose interactions would not fit in the memory budget are streamed to disk instead of kept in a list
+    streamed_file = protein_size * residue_bytes > budget
+    streamed = 0
+    interactions = []
 
-    # Filter out waters and heteroatoms
-    atoms = [atom for atom in structure.get_atoms() if not atom.get_parent().get_resname() == 'HOH' and not atom.get_parent().id[0] == 'W']
+    with open(f"{file.split('.')[0]}_contacts.tsv", "w") if streamed_file else nullcontext() as output:
+        # Filter out waters and heteroatoms
+        atoms = [atom for atom in structure.get_atoms() if not atom.get_parent().get_resname() == 'HOH' and not atom.get_parent().id[0] == 'W']
 
-    ns = NeighborSearch(atoms)
-    radius = 6.0
-    interactions = []
+        ns = NeighborSearch(atoms)
+        radius = 6.0
 
-    for atom in atoms:
-        residue_number = atom.get_parent().get_id()[1]
-        chain1 = atom.get_parent().get_parent().get_id()
-        atom1_name = f"{atom.get_parent().get_resname()}:{atom.get_name()}"
+        for atom in atoms:
+            residue_number = atom.get_parent().get_id()[1]
+            chain1 = atom.get_parent().get_parent().get_id()
+            atom1_name = f"{atom.get_parent().get_resname()}:{atom.get_name()}"
         
-        if atom1_name not in conditions_biop.contact_types:
-            continue
+            if atom1_name not in conditions_biop.contact_types:
+                continue
 
-        for neighbor in ns.search(atom.coord, radius):
-            neighbor_number = neighbor.get_parent().get_id()[1]
-            chain2 = neighbor.get_parent().get_parent().get_id()
+            for neighbor in ns.search(atom.coord, radius):
+                neighbor_number = neighbor.get_parent().get_id()[1]
+                chain2 = neighbor.get_parent().get_parent().get_id()
             
-            if atom == neighbor or residue_number >= neighbor_number:
-                continue
+                if atom == neighbor or residue_number >= neighbor_number:
+                    continue
 
-            atom2_name = f"{neighbor.get_parent().get_resname()}:{neighbor.get_name()}"
-            if atom2_name not in conditions_biop.contact_types:
-                continue
+                atom2_name = f"{neighbor.get_parent().get_resname()}:{neighbor.get_name()}"
+                if atom2_name not in conditions_biop.contact_types:
+                    continue
 
-            distance = atom - neighbor
+                distance = atom - neighbor
             
-            if atom1_name in conditions_biop.contact_types and atom2_name in conditions_biop.contact_types:
-                for interaction, condition in conditions_biop.contact_conditions.items():
-                    if interaction == 'hydrogen_bond' and (abs(neighbor_number - residue_number) <= 3):
-                        continue
-                    min_distance, max_distance = conditions_biop.categories[interaction]
-                    if min_distance <= distance <= max_distance and condition(atom1_name, atom2_name):
-                        interactions.append((atom1_name, residue_number, atom2_name, neighbor_number, interaction, distance, chain1, chain2))  
-        
+                if atom1_name in conditions_biop.contact_types and atom2_name in conditions_biop.contact_types:
+                    for interaction, condition in conditions_biop.contact_conditions.items():
+                        if interaction == 'hydrogen_bond' and (abs(neighbor_number - residue_number) <= 3):
+                            continue
+                        min_distance, max_distance = conditions_biop.categories[interaction]
+                        if min_distance <= distance <= max_distance and condition(atom1_name, atom2_name):
+                            if output:
+                                output.write("\t".join(map(str, (atom1_name, residue_number, atom2_name, neighbor_number, interaction, distance, chain1, chain2))) + "\n")
+                                streamed += 1
+                            else:
+                                interactions.append((atom1_name, residue_number, atom2_name, neighbor_number, interaction, distance, chain1, chain2))  
+
     interactions = sorted(interactions, key=lambda x:x[4])
 
     file = file.split(".")[0]
     time = timer() - start
-    print(file, protein_size, len(interactions), f"{time:.4f}")
+    print(file, protein_size, len(interactions) + streamed, f"{time:.4f}")
 
 print(f"Total time: {timer() - global_start}")
\ No newline at end of file
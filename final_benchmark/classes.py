@@ -46,13 +46,14 @@ class Chain:
 
 
 class Residue:
-    def __init__(self, resnum, resname, atoms, chain, ring, normal_vector):
+    def __init__(self, resnum, resname, atoms, chain, ring, normal_vector, code):
         self.resnum = resnum
         self.resname = resname
         self.atoms = atoms
         self.chain = chain
         self.ring = ring
         self.normal_vector = normal_vector
+        self.code = code
         
 class Atom:
     def __init__(self, atomname, x, y, z, occupancy, residue):
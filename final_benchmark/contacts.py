@@ -1,80 +1,199 @@
 from math import dist
-from numpy import dot, arccos, degrees
+from os.path import dirname, join, exists
+from numpy import load, dot, arccos, degrees, array, zeros, sqrt, triu, column_stack, concatenate, lexsort, argsort, flatnonzero
 from numpy.linalg import norm
 
 from classes import Contact
+from parser import residue_codes, residue_mapping
 import conditions
+import distances
 
-def contact_detection(protein, pair_index, distance_array):
+
+cutoff_version = 1 # see src/rules.py
+cutoff_file = join(dirname(__file__), "cutoffs.npz")
+
+
+def compile_cutoffs():
+    # symmetric matrix of the maximum alpha carbon distances, indexed by the residue codes of the parser
+    cutoffs = zeros((len(residue_codes), len(residue_codes)))
+    
+    if exists(cutoff_file): # binary table written by src/calibrate.py (margin included)
+        with load(cutoff_file) as table:
+            if int(table["version"]) != cutoff_version:
+                raise ValueError(f"{cutoff_file} is a version {int(table['version'])} cutoff table, version {cutoff_version} is needed!")
+            codes = array([residue_codes[residue_mapping[name]] for name in table["residue_names"].tolist()])
+            cutoffs[codes[:, None], codes[None, :]] = table["cutoffs"]
+        return cutoffs
+    
+    for (res1, res2), distance in distances.distances.items():
+        cutoffs[residue_codes[res1], residue_codes[res2]] = distance
+        cutoffs[residue_codes[res2], residue_codes[res1]] = distance
+    
+    return cutoffs
+
+
+cutoffs = compile_cutoffs()
+
+residue_bytes = 20000 # approximate memory of the contacts of one residue (a few dozen Contact objects)
+
+
+def candidate_pairs(ca_coords, codes, block=2048):
+    """
+    Finds the residue pairs that pass the CA prefilter (20.4 A and the cutoff of their residue types).
+
+    Distances are computed in (block, block) tiles and the pairs are yielded one band of block rows at a time, so
+    only the pairs of one band are held at once (a few hundred thousand at most) whatever the number of residues.
+
+    Yields:
+        tuple: (i, j) index pairs (i < j) in the order of the nested loop.
+    """
+    
+    for start1 in range(0, len(ca_coords), block):
+        block1, codes1 = ca_coords[start1:start1 + block], codes[start1:start1 + block]
+        band = []
+        
+        for start2 in range(start1, len(ca_coords), block):
+            block2, codes2 = ca_coords[start2:start2 + block], codes[start2:start2 + block]
+            
+            squared = zeros((len(block1), len(block2)))
+            for axis in range(3):
+                delta = block1[:, axis, None] - block2[None, :, axis]
+                squared += delta * delta
+            distances_ca = sqrt(squared)
+            
+            close = (distances_ca <= 20.4) & (distances_ca <= cutoffs[codes1[:, None], codes2[None, :]])
+            if start1 == start2: # same block: keeps each pair once and skips the residue itself
+                close = triu(close, 1)
+            
+            index1, index2 = close.nonzero()
+            band.append(column_stack((index1 + start1, index2 + start2)))
+        
+        band = concatenate(band)
+        for index1, index2 in band[lexsort((band[:, 1], band[:, 0]))].tolist(): # the first residues of later bands come after this one
+            yield index1, index2
+
+
+def contact_detection(protein):
 
     residues = list(protein.get_residues())
     contacts = []
+    indices, ca_coords, codes = alpha_carbons(residues)
+    
+    for index1, index2 in candidate_pairs(ca_coords, codes):
+        residue1, residue2 = residues[indices[index1]], residues[indices[index2]]
+        
+        if residue1.resnum == residue2.resnum and residue1.chain.id == residue2.chain.id: # ignores same residue
+            continue
+        
+        contacts.extend(residue_pair_contacts(protein, residue1, residue2))
+                                                                                                            
+    return contacts
+
+
+def slab_contact_detection(protein, path, budget):
+    """
+    Bounded-memory contact detection for giant structures.
+
+    Residues are split into slabs along x with as many residues as the memory budget allows, and the contacts
+    of each slab are written to a tab-separated file before the next slab is processed, so the Contact objects
+    of the whole structure are never held at once. A residue pair belongs to the slab of its first residue
+    (contacts are grouped by slab instead of following the nested loop order).
+
+    Args:
+        protein (Protein): Parsed structure.
+        path (str): Output file.
+        budget (int): Memory budget for contacts, in bytes.
+
+    Returns:
+        int: Number of contacts written.
+    """
+
+    residues = list(protein.get_residues())
+    indices, ca_coords, codes = alpha_carbons(residues)
+    slab_size = max(1, budget // residue_bytes)
+    order = argsort(ca_coords[:, 0], kind="stable")
+    count = 0
     
-    for i, residue1 in enumerate(residues[1:]):
-        for _, residue2 in enumerate(residues[i+1:], start=i+1):
+    with open(path, "w") as output:
+        for start in range(0, len(order), slab_size):
+            slab = zeros(len(indices), dtype=bool)
+            slab[order[start:start + slab_size]] = True
             
-            if residue1.resnum == residue2.resnum and residue1.chain.id == residue2.chain.id: # ignores same residue
-                continue
+            # the slab and every residue close enough in x to pair with it
+            low, high = ca_coords[slab, 0].min() - 20.4, ca_coords[slab, 0].max() + 20.4
+            halo = flatnonzero((ca_coords[:, 0] >= low) & (ca_coords[:, 0] <= high))
             
-            if len(residue1.atoms) > 1 and len(residue2.atoms) > 1:
-                ca1, ca2 = residue1.atoms[1], residue2.atoms[1] # alpha carbons
-
-                distance_ca = dist((ca1.x, ca1.y, ca1.z), (ca2.x, ca2.y, ca2.z))
+            for index1, index2 in candidate_pairs(ca_coords[halo], codes[halo]):
+                index1, index2 = halo[index1], halo[index2]
+                if not slab[index1]:
+                    continue
                 
-                if distance_ca > 20.4:
+                residue1, residue2 = residues[indices[index1]], residues[indices[index2]]
+                if residue1.resnum == residue2.resnum and residue1.chain.id == residue2.chain.id: # ignores same residue
                     continue
-                else:
-                    key = ''.join(sorted((residue1.resname, residue2.resname)))
-                    index = pair_index[key]
-                    if distance_ca > distance_array[index]:
-                        continue
+                
+                for contact in residue_pair_contacts(protein, residue1, residue2):
+                    output.write("\t".join(map(str, contact.print_values())) + "\n")
+                    count += 1
+    
+    return count
+
+
+def alpha_carbons(residues):
+    # same residues as the nested loop: it starts from residues[1:] and needs an alpha carbon (atoms[1])
+    indices = [i for i, residue in enumerate(residues) if i > 0 and len(residue.atoms) > 1]
+    ca_coords = array([(residues[i].atoms[1].x, residues[i].atoms[1].y, residues[i].atoms[1].z) for i in indices]).reshape(-1, 3)
+    codes = array([residues[i].code for i in indices], dtype=int)
+    
+    return indices, ca_coords, codes
 
+
+def residue_pair_contacts(protein, residue1, residue2):
+    contacts = []
+    
+    # CHECKING FOR AROMATIC STACKINGS
+    if residue1.ring and residue2.ring:
+        ring1, ring2 = residue1.atoms[-1], residue2.atoms[-1] # RNG atoms
+        distance = dist((ring1.x, ring1.y, ring1.z), (ring2.x, ring2.y, ring2.z))
+        angle = calc_angle(residue1.normal_vector, residue2.normal_vector)
+        if distance >= 2 and distance <= 5: # within aromatic stacking limits
+            if (160 <= angle < 180) or (0 <= angle < 20):
+                stack_type = "-parallel"
+            elif (80 <= angle < 100):
+                stack_type = "-perpendicular"
             else:
-                continue              
+                stack_type = "-other"
+
+            contact = Contact(protein.id, residue1.chain.id, residue1.resnum, residue1.resname, ring1.atomname, 
+                            protein.id, residue2.chain.id, residue2.resnum, residue2.resname, ring2.atomname, 
+                            float(f"{distance:.2f}"), "stacking"+stack_type, ring1, ring2)
             
-            # CHECKING FOR AROMATIC STACKINGS
-            if residue1.ring and residue2.ring:
-                ring1, ring2 = residue1.atoms[-1], residue2.atoms[-1] # RNG atoms
-                distance = dist((ring1.x, ring1.y, ring1.z), (ring2.x, ring2.y, ring2.z))
-                angle = calc_angle(residue1.normal_vector, residue2.normal_vector)
-                if distance >= 2 and distance <= 5: # within aromatic stacking limits
-                    if (160 <= angle < 180) or (0 <= angle < 20):
-                        stack_type = "-parallel"
-                    elif (80 <= angle < 100):
-                        stack_type = "-perpendicular"
-                    else:
-                        stack_type = "-other"
-
-                    contact = Contact(protein.id, residue1.chain.id, residue1.resnum, residue1.resname, ring1.atomname, 
-                                    protein.id, residue2.chain.id, residue2.resnum, residue2.resname, ring2.atomname, 
-                                    float(f"{distance:.2f}"), "stacking"+stack_type, ring1, ring2)
-                    
-                    contacts.append(contact)
-                    
-            for atom1 in residue1.atoms:
-                for atom2 in residue2.atoms:
-                    name1 = f"{atom1.residue.resname}:{atom1.atomname}" # matches the pattern from contacts dictionary
-                    name2 = f"{atom2.residue.resname}:{atom2.atomname}"
-                    
-                    if name1 in conditions.contact_types and name2 in conditions.contact_types: # excludes the RNG atom and any different other
-                        
-                        distance = dist((atom1.x, atom1.y, atom1.z), (atom2.x, atom2.y, atom2.z))
+            contacts.append(contact)
+            
+    for atom1 in residue1.atoms:
+        for atom2 in residue2.atoms:
+            name1 = f"{atom1.residue.resname}:{atom1.atomname}" # matches the pattern from contacts dictionary
+            name2 = f"{atom2.residue.resname}:{atom2.atomname}"
+            
+            if name1 in conditions.contact_types and name2 in conditions.contact_types: # excludes the RNG atom and any different other
+                
+                distance = dist((atom1.x, atom1.y, atom1.z), (atom2.x, atom2.y, atom2.z))
+                
+                if distance <= 6: # max distance for contacts
+                    for contact_type, distance_range in conditions.categories.items():
+
+                        if contact_type == 'hydrogen_bond' and (abs(residue2.resnum - residue1.resnum) <= 3): # skips alpha-helix for h-bonds
+                            continue
                         
-                        if distance <= 6: # max distance for contacts
-                            for contact_type, distance_range in conditions.categories.items():
-
-                                if contact_type == 'hydrogen_bond' and (abs(residue2.resnum - residue1.resnum) <= 3): # skips alpha-helix for h-bonds
-                                    continue
-                                
-                                if distance_range[0] <= distance <= distance_range[1]: # fits the range
-                                    if conditions.contact_conditions[contact_type](name1, name2): # fits the type of contact
-                                                                                                
-                                        contact = Contact(protein.id, residue1.chain.id, residue1.resnum, residue1.resname, atom1.atomname, 
-                                                        protein.id, residue2.chain.id, residue2.resnum, residue2.resname, atom2.atomname, 
-                                                        float(f"{distance:.2f}"), contact_type, atom1, atom2)
-
-                                        contacts.append(contact)
-                                                                                                                
+                        if distance_range[0] <= distance <= distance_range[1]: # fits the range
+                            if conditions.contact_conditions[contact_type](name1, name2): # fits the type of contact
+                                                                                        
+                                contact = Contact(protein.id, residue1.chain.id, residue1.resnum, residue1.resname, atom1.atomname, 
+                                                protein.id, residue2.chain.id, residue2.resnum, residue2.resname, atom2.atomname, 
+                                                float(f"{distance:.2f}"), contact_type, atom1, atom2)
+
+                                contacts.append(contact)
+                                                                                                        
     return contacts
 
 
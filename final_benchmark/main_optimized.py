@@ -1,91 +1,81 @@
 import parser
 import argparser
 import contacts
-import distances
 
 from os import getpid
+from os.path import basename, splitext, join
 from timeit import default_timer as timer
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from multiprocessing import cpu_count
 from psutil import Process
-from numpy import zeros
 
 
 def main():
 
     global_time_start = timer()
-    file_list, core, mode, cnum = argparser.cl_parse()
+    file_list, core, mode, cnum, budget, out = argparser.cl_parse()
     
     if cnum:
         p = Process(getpid())
         p.cpu_affinity([int(cnum)])
         print(f"Running on core {cnum}")
             
-    # Get the list of pairs in the order they appear in the dictionary
-    pairs = list(distances.distances.keys())
-
-    distance_array = zeros(len(pairs))
-
-    # Create a mapping from pairs to array indices
-    pair_index = {pair: idx for idx, pair in enumerate(pairs)}
-    
-    # Fill the array with distances from the dictionary
-    for (res1, res2), distance in distances.distances.items():
-        pair = ''.join(sorted((res1, res2)))
-        distance_array[pair_index[pair]] = distance
-        
+    # the cutoff of every residue pair is compiled once into contacts.cutoffs
     if mode == "Single":
-        single(file_list, pair_index, distance_array)
+        single(file_list, budget, out)
     elif mode == "Multi":
-        multi(file_list, pair_index, distance_array, core)
+        multi(file_list, core, budget, out)
     
     print(f"Total time elapsed: {timer() - global_time_start}\n")
 
 
-def single(file_list, pair_index, distance_array):
+def single(file_list, budget, out):
     for file in file_list:
         try:
-            result = process_file(file, pair_index, distance_array)
+            result = process_file(file, budget, out)
             if result:
-                protein, contacts_list, process_time = result
-                print(protein.id, protein.true_count(), len(contacts_list), f"{process_time:.4f}")
+                protein, contact_count, process_time = result
+                print(protein.id, protein.true_count(), contact_count, f"{process_time:.4f}")
         except Exception as e:
             print(f"Error: {e}")
             
             
-def multi(file_list, pair_index, distance_array, core):
+def multi(file_list, core, budget, out):
     core = cpu_count() if core == 0 else core
     print(f"Starting processing with {core} cores") 
     
     with ProcessPoolExecutor(max_workers=core) as executor:
-        futures = {executor.submit(process_file, file, pair_index, distance_array): file for file in file_list}
+        futures = {executor.submit(process_file, file, budget, out): file for file in file_list}
         
         for future in as_completed(futures):
             try:
                 result = future.result()
                 if result:
-                    protein, contacts_list, process_time = result
-                    print(protein.id, protein.true_count(), len(contacts_list), f"{process_time:.4f}")
+                    protein, contact_count, process_time = result
+                    print(protein.id, protein.true_count(), contact_count, f"{process_time:.4f}")
             except Exception as e:
                 print(f"Error: {e}")
             finally:
                 del futures[future] # cleans memory to avoid bloating
            
                 
-def process_file(file_path, pair_index, distance_array):
+def process_file(file_path, budget, out):
     start_time = timer()
     
     try:
         parsed_data = parser.parse_pdb(file_path) if file_path.endswith(".pdb") else parser.parse_pdbx(file_path)
-            
-        if parsed_data.true_count() > 25000:
-            print(f"Skipping ID '{parsed_data.id}'. Size: {parsed_data.true_count()} residues")
-            return None
-
-        contacts_list = contacts.contact_detection(parsed_data, pair_index, distance_array)
+        
+        # structures whose contacts would not fit in the memory budget are streamed to disk slab by slab;
+        # there is no size limit, but the time still grows with the square of the residues (the CA prefilter
+        # compares every residue pair, its tiles only bound the memory), so very large structures take long
+        if parsed_data.true_count() * contacts.residue_bytes > budget:
+            name = splitext(basename(file_path))[0]
+            contact_count = contacts.slab_contact_detection(parsed_data, join(out, f"{name}_contacts.tsv"), budget)
+        else:
+            contact_count = len(contacts.contact_detection(parsed_data))
         
         process_time = timer() - start_time
-        return parsed_data, contacts_list, process_time
+        return parsed_data, contact_count, process_time
     
     except Exception as e:
         print(f"Error processing {file_path}: {e}")
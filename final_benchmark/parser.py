@@ -17,6 +17,7 @@ residue_mapping = {
     'LEU': 'L', 'LYS': 'K', 'MET': 'M', 'PHE': 'F', 'PRO': 'P',
     'SER': 'S', 'THR': 'T', 'TRP': 'W', 'TYR': 'Y', 'VAL': 'V'
 }
+residue_codes = {name: code for code, name in enumerate(residue_mapping.values())} # integer type of every residue
 
 
 def parse_pdb(pdb_file):
@@ -64,14 +65,14 @@ def parse_pdb(pdb_file):
 
                 if current_residue is None:  # new residue
                     atoms = []
-                    current_residue = Residue(resnum, resname, atoms, current_chain, False, None)
+                    current_residue = Residue(resnum, resname, atoms, current_chain, False, None, residue_codes[resname])
                     current_chain.residues.append(current_residue)
                 
                 if current_residue.resnum != resnum:
                     if len(current_residue.atoms) > 1:
                         current_chain.residues.append(current_residue) 
                     atoms = []
-                    current_residue = Residue(resnum, resname, atoms, current_chain, False, None)
+                    current_residue = Residue(resnum, resname, atoms, current_chain, False, None, residue_codes[resname])
                                                                 
                 atomname = line[12:16].replace(" ", "")
                 if atomname == "OXT": # OXT is the C-terminal Oxygen atom. However, it exhibits the same properties of any Oxygen
@@ -195,14 +196,14 @@ def parse_pdbx(pdbx_file):
 
                 if current_residue is None:  # new residue
                     atoms = []
-                    current_residue = Residue(resnum, resname, atoms, current_chain, False, None)
+                    current_residue = Residue(resnum, resname, atoms, current_chain, False, None, residue_codes[resname])
                     current_chain.residues.append(current_residue)
                 
                 if current_residue.resnum != resnum:
                     if len(current_residue.atoms) > 1:
                         current_chain.residues.append(current_residue) 
                     atoms = []
-                    current_residue = Residue(resnum, resname, atoms, current_chain, False, None)
+                    current_residue = Residue(resnum, resname, atoms, current_chain, False, None, residue_codes[resname])
                                                                 
                 atomname = line[atomname_index]
                 if atomname == "OXT": # OXT is the C-terminal Oxygen atom
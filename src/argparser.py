@@ -1,25 +1,102 @@
-from sys import exit
+from sys import exit, argv
+from re import fullmatch
 from argparse import ArgumentParser, ArgumentError, ArgumentTypeError
 
+import rules
+
 def cl_parse():
     try:
         parser = ArgumentParser(description='PDB/mmcif parser and fast contact detection')
         parser.add_argument('-pdb', nargs='+', required=True, type=validate_file, help='List of PDB files (at least one required)')
         parser.add_argument('-fast', action='store_false', required=False, help='Set if Hydrogen Bond and Hydrophobic contacts are calculated')
         parser.add_argument('-show', '--show_contacts', required=False, action='store_true', help='Shows a list of all contacts')
-        parser.add_argument('-core', type=int, required=False, default=0, help='Number of cores to use (only needed on Multi mode)')
-        parser.add_argument('-mode', required=False, default='Single', help='Select "SingleCore" or "MultiCore" mode')
+        parser.add_argument('-core', type=int, required=False, default=0, help='Number of cores to use (only needed on Multi and Shared modes)')
+        parser.add_argument('-mode', required=False, default='Single', help='Select "Single", "Multi" (one file per core) or "Shared" (all cores on each structure, tensor and numba engines) mode')
+        parser.add_argument('-arrays', required=False, action='store_true', help='Parses the structures into columnar arrays (ProteinArrays) instead of Atom/Residue objects')
+        parser.add_argument('-threads', type=int, required=False, default=1, help='Number of threads for the contact detection of each structure (only tensor and numba engines)')
+        parser.add_argument('-spheres', required=False, action='store_true', help='Prunes residue pairs with the bounding spheres of their atoms instead of the 21 A alpha carbon cutoff (only tensor and numba engines)')
+        parser.add_argument('-cutoffs', required=False, action='store_true', help='Also prunes residue pairs by the alpha carbon cutoff of their residue types, from the table of calibrate.py (src/cutoffs.npz) or else distances.py (python, grid, tensor and numba engines)')
+        parser.add_argument('-types', required=False, help='Comma separated contact categories to search for (e.g. disulfide_bond,salt_bridge or stacking), only residue types able to form them are paired (overrides -fast, only tensor and numba engines)')
+        parser.add_argument('-interface', nargs='+', required=False, help='Chain pairs to search for contacts between (e.g. A:B C:D) or "all" for every pair of chains, only residues near the other chain are paired (only tensor and numba engines)')
+        parser.add_argument('-region', nargs='+', required=False, type=region_spec, help='Searches only the contacts of a region with the rest of the structure: residue ranges (A:10-50), residues (A:10) or spheres around a point (x,y,z:radius, also with negative coordinates), joined (Single mode, tensor and numba engines)')
+        parser.add_argument('-models', required=False, action='store_true', help='Processes every model of each structure (NMR ensembles) with a topology parsed once (Single mode, tensor and numba engines)')
+        parser.add_argument('-dcd', nargs='+', required=False, default=[], help='DCD trajectories, one per PDB file (the topology of the trajectory), processed frame by frame like -models')
+        parser.add_argument('-occupancy', required=False, action='store_true', help='With -models or -dcd, writes the frequency of every contact over the frames to <name>_occupancy.tsv (frames split across -core processes)')
+        parser.add_argument('-skin', type=float, required=False, default=2.0, help='Skin of the neighbour list reused across models, in A (only with -models, 0 runs the engine on every model)')
+        parser.add_argument('-engine', required=False, default='python', help='Select the contact detection engine: "python" (all residue pairs), "grid" (cell list), "kdtree" (atom KD-tree), "tensor" (padded residue tensors) or "numba" (compiled tensor kernel)')
 
-        args = parser.parse_args()
+        args = parser.parse_args(negative_regions(argv[1:]))
 
         pdb_files = args.pdb
         fast = args.fast
         core = args.core
         show_contacts = args.show_contacts
         mode = args.mode
-        modes = ["Single", "Multi"]
+        modes = ["Single", "Multi", "Shared"]
         if mode not in modes:
             raise ValueError("Invalid Mode!")
+        arrays = args.arrays
+        engine = args.engine
+        engines = ["python", "grid", "kdtree", "tensor", "numba"]
+        if engine not in engines:
+            raise ValueError("Invalid Engine!")
+        threads = args.threads
+        if threads < 1:
+            raise ValueError("Invalid number of threads!")
+        if threads > 1 and engine not in ["tensor", "numba"]:
+            raise ValueError("Threads need the tensor or numba engine!")
+        if mode == "Shared" and engine not in ["tensor", "numba"]:
+            raise ValueError("Shared mode needs the tensor or numba engine!")
+        spheres = args.spheres
+        if spheres and engine not in ["tensor", "numba"]:
+            raise ValueError("Spheres need the tensor or numba engine!")
+        cutoffs = args.cutoffs
+        if cutoffs and engine == "kdtree":
+            raise ValueError("Cutoffs need the python, grid, tensor or numba engine!")
+        categories = args.types.split(',') if args.types else None
+        if categories is not None:
+            if not all(category in rules.category_names + ['stacking'] for category in categories):
+                raise ValueError(f"Invalid contact types! Choose from {', '.join(rules.category_names + ['stacking'])}")
+            if engine not in ["tensor", "numba"]:
+                raise ValueError("Types need the tensor or numba engine!")
+        interface = args.interface
+        if interface is not None:
+            if interface == ['all']:
+                interface = True
+            elif all(len(chain_pair.split(':')) == 2 for chain_pair in interface):
+                interface = [tuple(chain_pair.split(':')) for chain_pair in interface]
+            else:
+                raise ValueError("Invalid interface! Use chain pairs like A:B or all")
+            if engine not in ["tensor", "numba"]:
+                raise ValueError("Interface needs the tensor or numba engine!")
+        region = args.region
+        if region is not None:
+            if mode != "Single" or engine not in ["tensor", "numba"]:
+                raise ValueError("Region needs the Single mode and the tensor or numba engine!")
+            if categories is not None or interface is not None or threads > 1 or cutoffs:
+                raise ValueError("Region can't be combined with -types, -interface, -threads or -cutoffs!")
+        models = args.models
+        dcd_files = args.dcd
+        if dcd_files:
+            if len(dcd_files) != len(pdb_files) or not all(file.endswith('.pdb') for file in pdb_files):
+                raise ValueError("Each DCD trajectory needs its PDB topology file!")
+            models = True
+        if models and (mode != "Single" or engine not in ["tensor", "numba"]):
+            raise ValueError("Models need the Single mode and the tensor or numba engine!")
+        if models and categories is not None:
+            raise ValueError("Types can't be combined with -models or -dcd!")
+        if models and interface is not None:
+            raise ValueError("Interface can't be combined with -models or -dcd!")
+        if models and cutoffs:
+            raise ValueError("Cutoffs can't be combined with -models or -dcd!")
+        if models and region is not None:
+            raise ValueError("Region can't be combined with -models or -dcd!")
+        occupancy = args.occupancy
+        if occupancy and not models:
+            raise ValueError("Occupancy needs -models or -dcd!")
+        skin = args.skin
+        if skin < 0:
+            raise ValueError("Invalid skin!")
         
     except ArgumentError as e:
         print(f"Argument Error: {str(e)}")
@@ -33,10 +110,68 @@ def cl_parse():
         print(f"An unexpected error occurred: {str(e)}")
         exit(1)
     
-    return pdb_files, fast, core, show_contacts, mode
+    return pdb_files, fast, core, show_contacts, mode, arrays, engine, threads, models, skin, dcd_files, occupancy, spheres, categories, interface, region, cutoffs
         
+def calibration_parse():
+    try:
+        parser = ArgumentParser(description='Calibrates the residue pair cutoff table from the contacts of a corpus of structures')
+        parser.add_argument('-pdb', nargs='+', required=False, default=[], type=validate_file, help='List of PDB files')
+        parser.add_argument('-folder', required=False, help='Folder with the corpus (every .pdb, .pdbx and .cif file under it)')
+        parser.add_argument('-core', type=int, required=False, default=0, help='Number of cores to use (all by default)')
+        parser.add_argument('-margin', type=float, required=False, default=0.01, help='Safety margin added to the maximum alpha carbon distance of every residue pair, in A')
+        parser.add_argument('-quantiles', nargs='+', type=float, required=False, default=[0.5, 0.9, 0.99], help='Quantile levels of the alpha carbon distances kept in the table')
+        parser.add_argument('-out', required=False, default=rules.cutoff_file, help='Cutoff table file (.npz), by default the one loaded into rules.cutoffs for the -cutoffs option')
+
+        args = parser.parse_args()
+
+        pdb_files = args.pdb
+        folder = args.folder
+        if not pdb_files and not folder:
+            raise ValueError("No structures to calibrate!")
+        core = args.core
+        margin = args.margin
+        if margin < 0:
+            raise ValueError("Invalid margin!")
+        levels = args.quantiles
+        if not all(0 <= level <= 1 for level in levels):
+            raise ValueError("Invalid quantiles!")
+        out = args.out
+        
+    except ArgumentError as e:
+        print(f"Argument Error: {str(e)}")
+        exit(1)
+
+    except ValueError as e:
+        print(f"Error: {str(e)}")
+        exit(1)
+
+    except Exception as e:
+        print(f"An unexpected error occurred: {str(e)}")
+        exit(1)
+    
+    return pdb_files, folder, core, margin, levels, out
+
 def validate_file(value):
     if value.endswith('.pdb') or value.endswith('.pdbx') or value.endswith('.cif'):
         return value
     else:
         raise ArgumentTypeError(f"{value} is not a valid file. File must end with '.pdb', '.pdbx', or '.cif'")
+
+def negative_regions(arguments):
+    # argparse takes any value starting with "-" for an option, so spheres with a negative x (-10,5,3:4) get a leading space
+    return [" " + argument if fullmatch(r'-[\d.]+,.*', argument) else argument for argument in arguments]
+
+def region_spec(value):
+    # A:10-50 (residue range), A:10 (residue) or x,y,z:radius (sphere), see region.RegionQuery.select
+    head, _, tail = value.strip().rpartition(':')
+    residue_range = fullmatch(r'(-?\d+)-(-?\d+)', tail)
+    try:
+        if head.count(',') == 2:
+            return ("sphere", tuple(float(coordinate) for coordinate in head.split(',')), float(tail))
+        if head and residue_range:
+            return ("range", head, int(residue_range[1]), int(residue_range[2]))
+        if head and ',' not in head:
+            return ("residue", head, int(tail))
+    except ValueError:
+        pass
+    raise ArgumentTypeError(f"{value} is not a valid region. Use A:10-50, A:10 or x,y,z:radius")
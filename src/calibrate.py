@@ -0,0 +1,99 @@
+import parser
+import argparser
+import contacts
+import neighbours
+import rules
+
+from os import walk
+from os.path import join
+from timeit import default_timer as timer
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count
+from numpy import zeros, concatenate, unique, maximum, floor, clip, add, cumsum, argmax, array, int64, float64
+
+# alpha carbon distance histograms of the residue pairs with contacts, in 0.01 A bins up to the 21 A candidate cutoff
+bin_width = 0.01
+bin_count = int(round(neighbours.ca_cutoff / bin_width))
+
+
+def main():
+
+    global_time_start = timer()
+    file_list, folder, core, margin, levels, out = argparser.calibration_parse()
+    file_list = file_list + corpus_files(folder) if folder else file_list
+    if core == 0:
+        core = cpu_count()
+
+    print(f"Calibrating with {len(file_list)} structures on {core} cores\n")
+
+    residues = len(rules.residue_names)
+    histograms = zeros((residues, residues, bin_count), dtype=int64)
+    maxima = zeros((residues, residues))
+
+    # structures are streamed through the pool, only the alpha carbon distances of their contacting residue pairs come back
+    with ProcessPoolExecutor(max_workers=core) as executor:
+        for file_path, samples in zip(file_list, executor.map(residue_pair_samples, file_list, chunksize=4)):
+            if samples is None:
+                print(f"Error: {file_path} could not be parsed")
+                continue
+            types1, types2, distances = samples
+            other = types1 != types2 # the table is symmetric
+            types1, types2, distances = concatenate((types1, types2[other])), concatenate((types2, types1[other])), concatenate((distances, distances[other]))
+            maximum.at(maxima, (types1, types2), distances)
+            add.at(histograms, (types1, types2, clip(floor(distances / bin_width).astype(int64), 0, bin_count - 1)), 1)
+
+    counts = histograms.sum(axis=2)
+    quantiles = histogram_quantiles(histograms, counts, levels)
+    cutoffs = (maxima + margin).round(6)
+    cutoffs[counts == 0] = neighbours.ca_cutoff # no contacts seen: no pruning
+    rules.write_cutoffs(out, cutoffs, maxima, counts, array(levels), quantiles, margin)
+
+    print("res1 res2 pairs maximum", *[f"q{level:g}" for level in levels])
+    for type1 in range(residues):
+        for type2 in range(type1, residues):
+            print(rules.residue_names[type1], rules.residue_names[type2], counts[type1, type2], f"{maxima[type1, type2]:.2f}",
+                  *[f"{quantile:.2f}" for quantile in quantiles[:, type1, type2]])
+
+    print(f"\nCutoff table written to {out}")
+    print(f"Total time elapsed: {timer() - global_time_start}\n")
+
+
+def residue_pair_samples(file_path):
+    """
+    Process pool worker: residue ids and alpha carbon distance of every residue pair with a contact.
+    """
+
+    try:
+        arrays = parser.parse_pdb_arrays(file_path) if file_path.endswith(".pdb") else parser.parse_pdbx_arrays(file_path)
+    except (KeyError, ValueError):
+        return None
+
+    # one frame of a neighbour list without skin: the contacts of the tensor engine, without Contact objects
+    neighbour_list = neighbours.NeighbourList(contacts.tensor_topology(arrays, rules.category_mask(True)), True, 0)
+    pairs, ca_distances, pair, _, _, _, _ = neighbour_list.hits(arrays.coords)
+    stacked = contacts.stacked_pairs(arrays, neighbour_list.selected, pairs, contacts.stacking_detection(arrays))
+    contacting = unique(concatenate((pair, stacked.nonzero()[0])))
+
+    rows = neighbour_list.selected[pairs[contacting]]
+    types = arrays.residue_types[rows].astype(int64)
+    return types[:, 0], types[:, 1], ca_distances[contacting].astype(float64)
+
+
+def histogram_quantiles(histograms, counts, levels):
+    # upper edge of the first bin holding each quantile (never below the true quantile), 0 for pairs without contacts
+    totals = cumsum(histograms, axis=2)
+    quantiles = zeros((len(levels), *counts.shape))
+    for index, level in enumerate(levels):
+        reached = totals >= (level * counts)[:, :, None]
+        quantiles[index] = (argmax(reached, axis=2) + 1) * bin_width
+    quantiles[:, counts == 0] = 0
+    return quantiles
+
+
+def corpus_files(folder):
+    # every structure file under the folder
+    return sorted(join(root, name) for root, _, names in walk(folder) for name in names if name.endswith(('.pdb', '.pdbx', '.cif')))
+
+
+if __name__ == "__main__":
+    main()
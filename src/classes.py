@@ -1,8 +1,18 @@
+from sys import intern
+from numpy import array, nan, float64, int64, int32, int16, int8
+
+import rules
+import spatial
+
+
 class Protein:
+    __slots__ = ('title', 'id', 'chains', 'atoms')
+
     def __init__(self):
         self.title = None
         self.id = None
         self.chains = []
+        self.atoms = [] # every parsed atom, by index (RNG atoms excluded)
 
     def set_title(self, title):
         if self.title is None:
@@ -37,6 +47,8 @@ class Protein:
             
 
 class Chain:
+    __slots__ = ('id', 'residues')
+
     def __init__(self, id, residues):
         self.id = id
         self.residues = residues
@@ -46,6 +58,8 @@ class Chain:
 
 
 class Residue:
+    __slots__ = ('resnum', 'resname', 'atoms', 'chain', 'ring', 'normal_vector')
+
     def __init__(self, resnum, resname, atoms, chain, ring, normal_vector):
         self.resnum = resnum
         self.resname = resname
@@ -55,41 +69,250 @@ class Residue:
         self.normal_vector = normal_vector
         
 class Atom:
-    def __init__(self, atomname, x, y, z, occupancy, residue):
+    __slots__ = ('atomname', 'x', 'y', 'z', 'occupancy', 'residue', 'index')
+
+    def __init__(self, atomname, x, y, z, occupancy, residue, index=-1):
         self.atomname = atomname
         self.x = x
         self.y = y
         self.z = z
         self.occupancy = occupancy
         self.residue = residue
+        self.index = index # position in Protein.atoms (-1 for the RNG pseudo-atom)
 
 
-class Contact: 
-    def __init__(self, id1, chain1, residue_num1, residue_name1, atom1, 
-                 id2, chain2, residue_num2, residue_name2, atom2, 
-                 distance, type, atom_object1, atom_object2):
-        self.id1 = id1
+class Contact:
+    __slots__ = ('id', 'chain1', 'residue_num1', 'residue_name1', 'atom1',
+                 'chain2', 'residue_num2', 'residue_name2', 'atom2',
+                 'distance', 'type', 'atom_index1', 'atom_index2')
+
+    def __init__(self, id, chain1, residue_num1, residue_name1, atom1, 
+                 chain2, residue_num2, residue_name2, atom2, 
+                 distance, type, atom_index1, atom_index2):
+        self.id = id
         self.chain1 = chain1
         self.residue_num1 = residue_num1
         self.residue_name1 = residue_name1
         self.atom1 = atom1
-        self.id2 = id2
         self.chain2 = chain2
         self.residue_num2 = residue_num2
         self.residue_name2 = residue_name2
         self.atom2 = atom2
         self.distance = distance
         self.type = type
-        self.atom_object1 = atom_object1
-        self.atom_object2 = atom_object2
-    
+        self.atom_index1 = atom_index1 # atom indices in the protein (Protein.atoms / ProteinArrays), -1 for RNG
+        self.atom_index2 = atom_index2
+
+    def __reduce__(self): # pickles as a plain tuple of values (Multi mode sends every contact back to the parent)
+        return (Contact, tuple(getattr(self, name) for name in Contact.__slots__))
+
+    @property
+    def id1(self):
+        return self.id
+
+    @property
+    def id2(self):
+        return self.id
+
     def print_values(self):
-        all_values = list(self.__dict__.values())
-        return [f"{all_values[0]}:{all_values[1]}", f"{all_values[2]}{all_values[3]}:{all_values[4]}",
-                f"{all_values[5]}:{all_values[6]}", f"{all_values[7]}{all_values[8]}:{all_values[9]}",
-                all_values[10], all_values[11]]
+        return [f"{self.id}:{self.chain1}", f"{self.residue_num1}{self.residue_name1}:{self.atom1}",
+                f"{self.id}:{self.chain2}", f"{self.residue_num2}{self.residue_name2}:{self.atom2}",
+                self.distance, self.type]
     
     def print_text(self):
-        all_values = list(self.__dict__.values())
-        return f"{all_values[1]}-{all_values[2]}{all_values[3]}:{all_values[4]} and {all_values[6]}-{all_values[7]}{all_values[8]}:{all_values[9]}: {all_values[10]} A. {all_values[11].capitalize()}"
+        return f"{self.chain1}-{self.residue_num1}{self.residue_name1}:{self.atom1} and {self.chain2}-{self.residue_num2}{self.residue_name2}:{self.atom2}: {self.distance} A. {self.type.capitalize()}"
+
+
+class ProteinArrays:
+    """
+    Columnar (struct-of-arrays) version of Protein, filled directly by parser.parse_pdb_arrays and parser.parse_pdbx_arrays.
+
+    Residue rows follow the order of Protein.get_residues(), atoms are stored once per residue (without the RNG pseudo-atom,
+    which is kept in ring_centroids). The Protein/Chain/Residue/Atom objects are only built if view() is called.
+    """
+    def __init__(self, id, title, coords, atom_names, atom_types, occupancy, atom_residue,
+                 resnums, residue_types, residue_chain, residue_start, residue_end, chain_ids,
+                 ring, ring_centroids, ring_normals, source=None, sphere_centres=None, sphere_radii=None):
+        self.id = id
+        self.title = title
+        
+        # per atom
+        self.coords = coords                 # (atoms, 3) float64 (or float32)
+        self.atom_names = atom_names         # (atoms,) str
+        self.atom_types = atom_types         # (atoms,) int16, index in rules.type_names (-1 if it can't form contacts)
+        self.occupancy = occupancy           # (atoms,) float64
+        self.atom_residue = atom_residue     # (atoms,) int32, first residue row holding the atom (-1 if none)
+        self.source = source                 # (atoms,) int64, position of the atom among the ATOM lines of its model (None if not parsed)
+        
+        # per residue row
+        self.resnums = resnums               # (residues,) int32
+        self.residue_types = residue_types   # (residues,) int8, index in rules.residue_names
+        self.residue_chain = residue_chain   # (residues,) int32, index in chain_ids
+        self.residue_start = residue_start   # (residues,) int64, atoms of a residue are coords[start:end]
+        self.residue_end = residue_end
+        self.ring = ring                     # (residues,) bool
+        self.ring_centroids = ring_centroids # (residues, 3), nan if not ring
+        self.ring_normals = ring_normals     # (residues, 3), nan if not ring
+        self.sphere_centres = sphere_centres # (residues, 3), bounding sphere of the atoms that can form contacts (see spheres)
+        self.sphere_radii = sphere_radii     # (residues,), nan if the residue has no such atoms
+        
+        self.chain_ids = chain_ids           # (chains,) str
+        
+        self.protein = None  # lazy object view
+        self.residues = None # Residue objects of the view, by residue row
+        self.atoms = None    # Atom objects of the view, by atom index
+
+    def true_count(self):
+        return len(self.resnums)
+
+    def spheres(self):
+        # computed at parse time by parse_*_arrays, and here for other coordinates (to_arrays, ensemble models)
+        if self.sphere_centres is None:
+            self.sphere_centres, self.sphere_radii = spatial.range_spheres(self.coords, self.residue_start, self.residue_end, self.atom_types >= 0)
+        return self.sphere_centres, self.sphere_radii
+
+    def full_count(self):
+        return self.view().full_count()
 
+    def get_chains(self):
+        return self.view().get_chains()
+
+    def get_residues(self):
+        return self.view().get_residues()
+
+    def residue(self, row):
+        if self.residues is None:
+            self.view()
+        return self.residues[row]
+
+    def atom(self, index):
+        if self.atoms is None:
+            self.view()
+        return self.atoms[index]
+
+    def view(self):
+        if self.protein is not None:
+            return self.protein
+
+        protein = Protein()
+        protein.id = self.id
+        protein.title = self.title
+        chains = [Chain(intern(str(chain_id)), []) for chain_id in self.chain_ids]
+        
+        atoms = [None] * len(self.coords) # atoms of residues dropped by the parser stay None
+        rows = []
+        coords = self.coords.tolist()
+        residues = {}
+        last_chain = None
+        for row in range(len(self.resnums)):
+            start, end = int(self.residue_start[row]), int(self.residue_end[row])
+            chain = chains[self.residue_chain[row]]
+            key = (start, end, int(self.resnums[row]), chain.id)
+            
+            residue = residues.get(key)
+            if residue is None:
+                residue = Residue(int(self.resnums[row]), rules.residue_names[self.residue_types[row]], [], chain, bool(self.ring[row]), None)
+                for index in range(start, end):
+                    x, y, z = coords[index]
+                    atoms[index] = Atom(intern(str(self.atom_names[index])), x, y, z, float(self.occupancy[index]), residue, index)
+                    residue.atoms.append(atoms[index])
+                if residue.ring:
+                    x, y, z = self.ring_centroids[row].tolist()
+                    residue.atoms.append(Atom("RNG", x, y, z, 1, residue))
+                    residue.normal_vector = self.ring_normals[row]
+                residues[key] = residue
+            
+            if chain is not last_chain:
+                protein.chains.append(chain)
+                last_chain = chain
+            chain.residues.append(residue)
+            rows.append(residue)
+        
+        protein.atoms = atoms
+        self.protein = protein
+        self.residues = rows
+        self.atoms = atoms
+        return protein
+
+
+class Ensemble:
+    """
+    All the models of one structure (NMR ensembles, trajectories): the topology is parsed once into a ProteinArrays
+    (the first model) and the coordinates of every model are kept in one (models, atoms, 3) array.
+    Filled by parser.parse_ensemble.
+    """
+    def __init__(self, topology, coords, ring_centroids, ring_normals):
+        self.topology = topology             # ProteinArrays of the first model
+        self.coords = coords                 # (models, atoms, 3) float64
+        self.ring_centroids = ring_centroids # (models, residues, 3), nan if not ring
+        self.ring_normals = ring_normals     # (models, residues, 3), nan if not ring
+
+    def model_count(self):
+        return len(self.coords)
+
+    def model(self, index):
+        return self.with_coords(self.coords[index], self.ring_centroids[index], self.ring_normals[index])
+
+    def with_coords(self, coords, ring_centroids, ring_normals):
+        # ProteinArrays of one model: shares every topology array, only coordinates and rings are its own
+        topology = self.topology
+        return ProteinArrays(topology.id, topology.title, coords, topology.atom_names, topology.atom_types,
+                             topology.occupancy, topology.atom_residue, topology.resnums, topology.residue_types,
+                             topology.residue_chain, topology.residue_start, topology.residue_end, topology.chain_ids,
+                             topology.ring, ring_centroids, ring_normals, topology.source)
+
+
+def to_arrays(protein):
+    """
+    Converts a parsed Protein into ProteinArrays (keeping the Protein as its view), or returns ProteinArrays unchanged.
+    Atom indices are kept, so contacts refer to the same atoms in both models.
+    """
+    if isinstance(protein, ProteinArrays):
+        return protein
+
+    atoms = protein.atoms
+    atom_residue = [-1] * len(atoms)
+    rows, resnums, residue_types, residue_chain, residue_start, residue_end = [], [], [], [], [], []
+    ring, ring_centroids, ring_normals = [], [], []
+    chain_ids, chain_index = [], {}
+
+    for row, residue in enumerate(protein.get_residues()):
+        rows.append(residue)
+        chain = residue.chain
+        if id(chain) not in chain_index:
+            chain_index[id(chain)] = len(chain_ids)
+            chain_ids.append(chain.id)
+        
+        residue_atoms = residue.atoms[:-1] if residue.ring else residue.atoms # without the RNG atom
+        start = residue_atoms[0].index if residue_atoms else 0
+        end = start + len(residue_atoms)
+        for index in range(start, end):
+            if atom_residue[index] == -1: # first row wins for duplicated residues
+                atom_residue[index] = row
+        
+        resnums.append(residue.resnum)
+        residue_types.append(rules.residue_ids[residue.resname])
+        residue_chain.append(chain_index[id(chain)])
+        residue_start.append(start)
+        residue_end.append(end)
+        ring.append(bool(residue.ring))
+        if residue.ring:
+            ring_centroids.append((residue.atoms[-1].x, residue.atoms[-1].y, residue.atoms[-1].z))
+            ring_normals.append(residue.normal_vector)
+        else:
+            ring_centroids.append((nan, nan, nan))
+            ring_normals.append((nan, nan, nan))
+
+    atom_types = [rules.type_ids.get(f"{atom.residue.resname}:{atom.atomname}", -1) for atom in atoms]
+    
+    arrays = ProteinArrays(protein.id, protein.title,
+                           array([(atom.x, atom.y, atom.z) for atom in atoms], dtype=float64).reshape(-1, 3), array([atom.atomname for atom in atoms], dtype=str),
+                           array(atom_types, dtype=int16), array([atom.occupancy for atom in atoms], dtype=float64), array(atom_residue, dtype=int32),
+                           array(resnums, dtype=int32), array(residue_types, dtype=int8), array(residue_chain, dtype=int32),
+                           array(residue_start, dtype=int64), array(residue_end, dtype=int64), array(chain_ids, dtype=str),
+                           array(ring, dtype=bool), array(ring_centroids, dtype=float64).reshape(-1, 3), array(ring_normals, dtype=float64).reshape(-1, 3))
+    arrays.protein = protein
+    arrays.residues = rows
+    arrays.atoms = atoms
+    
+    return arrays
@@ -1,102 +1,676 @@
 from math import dist
+from sys import intern
 from timeit import default_timer as timer
-from numpy import dot, arccos, degrees
+from concurrent.futures import ThreadPoolExecutor
+from numpy import arccos, degrees, array, lexsort, flatnonzero, concatenate, full, errstate, nan, where, zeros, sqrt, searchsorted, arange, unique, isnan, bincount, cumsum, minimum, maximum, inf, int32, uint8
 from numpy.linalg import norm
 
-from classes import Contact
+from classes import Contact, to_arrays
 import conditions
 import distances
+import spatial
+import rules
+import kernels
+import shared
+import neighbours
 
-def contact_detection(protein, fast, maximum_distances):
+def contact_detection(protein, fast, maximum_distances, cutoffs=False):
+    # with cutoffs, residue pairs are also pruned by the alpha carbon cutoff of their residue types (rules.cutoffs)
     start = timer()
     
     residues = list(protein.get_residues())
     contacts = []
+    stackings = stacking_detection(to_arrays(protein))
     
-    for i, residue1 in enumerate(residues[1:]):
-        for j, residue2 in enumerate(residues[i+1:], start=i+1):
-            
-            if residue1.resnum == residue2.resnum and residue1.chain.id == residue2.chain.id: # ignores same residue
-                continue
-            
-            if len(residue1.atoms) > 1 and len(residue2.atoms) > 1:
-                ca1, ca2 = residue1.atoms[1], residue2.atoms[1] # alpha carbons
+    # same residues as the nested loop: it starts from residues[1:] and needs an alpha carbon (atoms[1])
+    indices = [i for i, residue in enumerate(residues) if i > 0 and len(residue.atoms) > 1]
+    ca_coords = array([(residues[i].atoms[1].x, residues[i].atoms[1].y, residues[i].atoms[1].z) for i in indices]).reshape(-1, 3)
+    
+    # candidate residue pairs: all alpha carbon distances, computed in memory-bounded tiles
+    types = array([rules.residue_ids[residues[i].resname] for i in indices], dtype=int)
+    pairs, ca_distances = spatial.tiled_pairs(ca_coords, 21, *((types, rules.cutoffs) if cutoffs else ()))
+    
+    for (index1, index2), distance_ca in zip(pairs.tolist(), ca_distances.tolist()):
+        row1, row2 = indices[index1], indices[index2]
+        residue1, residue2 = residues[row1], residues[row2]
+        
+        if residue1.resnum == residue2.resnum and residue1.chain.id == residue2.chain.id: # ignores same residue
+            continue
+        
+        contacts.extend(residue_pair_contacts(protein, residue1, residue2, distance_ca, fast, maximum_distances, stackings.get((row1, row2))))
+
+    end = timer()
+    current_time = end - start
+
+    return contacts, current_time, maximum_distances
+
+
+def contact_detection_grid(protein, fast, maximum_distances, cutoffs=False):
+    # with cutoffs, residue pairs are also pruned by the alpha carbon cutoff of their residue types (rules.cutoffs)
+    start = timer()
+    
+    residues = list(protein.get_residues())
+    contacts = []
+    stackings = stacking_detection(to_arrays(protein))
+    
+    # same residues as the nested loop: it starts from residues[1:] and needs an alpha carbon (atoms[1])
+    indices = [i for i, residue in enumerate(residues) if i > 0 and len(residue.atoms) > 1]
+    ca_coords = array([(residues[i].atoms[1].x, residues[i].atoms[1].y, residues[i].atoms[1].z) for i in indices]).reshape(-1, 3)
+    
+    # only alpha carbons in the same or neighbouring 21 A cells are compared
+    pairs, ca_distances = spatial.grid_pairs(ca_coords, 21)
+    if cutoffs:
+        types = array([rules.residue_ids[residues[i].resname] for i in indices], dtype=int)
+        within = ca_distances <= rules.cutoffs[types[pairs[:, 0]], types[pairs[:, 1]]]
+        pairs, ca_distances = pairs[within], ca_distances[within]
+    
+    for (index1, index2), distance_ca in zip(pairs.tolist(), ca_distances.tolist()):
+        row1, row2 = indices[index1], indices[index2]
+        residue1, residue2 = residues[row1], residues[row2]
+        
+        if residue1.resnum == residue2.resnum and residue1.chain.id == residue2.chain.id: # ignores same residue
+            continue
+        
+        contacts.extend(residue_pair_contacts(protein, residue1, residue2, distance_ca, fast, maximum_distances, stackings.get((row1, row2))))
+    
+    end = timer()
+    current_time = end - start
 
-                distance_ca = dist((ca1.x, ca1.y, ca1.z), (ca2.x, ca2.y, ca2.z))
+    return contacts, current_time, maximum_distances
+
+
+def contact_detection_kdtree(protein, fast, maximum_distances):
+    start = timer()
+    
+    arrays = to_arrays(protein)
+    contacts = []
+    
+    # same residues as the nested loop: it starts from residues[1:] and needs an alpha carbon (atoms[1])
+    sizes = arrays.residue_end - arrays.residue_start + arrays.ring
+    selected = flatnonzero(sizes > 1)
+    selected = selected[selected > 0]
+    ca_coords = arrays.coords[arrays.residue_start[selected] + 1].reshape(-1, 3)
+    resnums = arrays.resnums[selected].astype(int)
+    chains = arrays.chain_ids[arrays.residue_chain[selected]]
+    
+    # flat table of every atom active for the enabled categories (duplicated residue rows get their atoms twice, as in the loop)
+    mask = rules.category_mask(fast)
+    active, reach = rules.compile_rules(mask)
+    atom_residue, local = spatial.expand_ranges(arrays.residue_end[selected] - arrays.residue_start[selected])
+    atom_index = arrays.residue_start[selected][atom_residue] + local
+    capable = arrays.atom_types[atom_index] >= 0
+    capable[capable] = active[arrays.atom_types[atom_index[capable]]]
+    atom_residue, atom_index = atom_residue[capable], atom_index[capable]
+    atom_types = arrays.atom_types[atom_index]
+    
+    # one query for every atom pair within the largest effective cutoff, then the cutoff of each pair of atom types
+    pairs, pair_distances = spatial.kdtree_pairs(arrays.coords[atom_index], reach.max(initial=0))
+    within = pair_distances <= reach[atom_types[pairs[:, 0]], atom_types[pairs[:, 1]]]
+    pairs, pair_distances = pairs[within], pair_distances[within]
+    residue_pairs = atom_residue[pairs]
+    
+    # every stacking of the structure, found in one vectorized pass (keyed by residue rows)
+    stackings = stacking_detection(arrays)
+    positions = full(len(arrays.resnums), -1)
+    positions[selected] = range(len(selected))
+    ring_pairs = positions[array(list(stackings), dtype=int).reshape(-1, 2)]
+    ring_pairs = ring_pairs[(ring_pairs >= 0).all(axis=1)]
+    
+    # same residue pairs the nested loop accepts: different residues with alpha carbons up to 21 A apart
+    def accepted(residue_pairs):
+        first, second = residue_pairs[:, 0], residue_pairs[:, 1]
+        different = (first != second) & ((resnums[first] != resnums[second]) | (chains[first] != chains[second]))
+        delta = ca_coords[first] - ca_coords[second]
+        return different & ((delta * delta).sum(axis=1) <= 21 ** 2)
+    
+    keep = accepted(residue_pairs)
+    pairs, pair_distances, residue_pairs = pairs[keep], pair_distances[keep], residue_pairs[keep]
+    ring_pairs = ring_pairs[accepted(ring_pairs)]
+    
+    # every candidate pair is classified in one vectorized step
+    helix = abs(resnums[residue_pairs[:, 1]] - resnums[residue_pairs[:, 0]]) <= 3
+    hits, categories = rules.classify(atom_types[pairs[:, 0]], atom_types[pairs[:, 1]], pair_distances, helix, mask)
+    
+    # visits residue pairs in the same order as the nested loop (atoms follow residue order, so index1 < index2)
+    hit_pairs = pairs[hits]
+    hit_residues = residue_pairs[hits]
+    order = lexsort((categories, hit_pairs[:, 1], hit_pairs[:, 0], hit_residues[:, 1], hit_residues[:, 0]))
+    hits, categories, hit_pairs, hit_residues = hits[order], categories[order], hit_pairs[order], hit_residues[order]
+    
+    groups = {}
+    for position, key in enumerate(map(tuple, hit_residues.tolist())):
+        groups.setdefault(key, [position, position])[1] = position + 1
+    for key in map(tuple, ring_pairs.tolist()):
+        groups.setdefault(key, [0, 0])
+    
+    for index1, index2 in sorted(groups):
+        row1, row2 = selected[index1], selected[index2]
+        distance_ca = dist(ca_coords[index1], ca_coords[index2])
+        
+        # CHECKING FOR AROMATIC STACKINGS
+        if (row1, row2) in stackings:
+            distance, stack_type = stackings[row1, row2]
+            contacts.append(array_contact(arrays, row1, row2, -1, -1, distance, stack_type))
+        
+        begin, end = groups[index1, index2]
+        for hit, category, (atom_index1, atom_index2) in zip(hits[begin:end].tolist(), categories[begin:end].tolist(), atom_index[hit_pairs[begin:end]].tolist()):
+            contact = array_contact(arrays, row1, row2, atom_index1, atom_index2, pair_distances[hit], rules.category_names[category])
+            contacts.append(contact)
             
-                # pair = tuple(sorted((residue1.resname, residue2.resname)))
-                # if distance_ca > (distances.distances[pair] + 0.01):
-                #    continue
+            record_maximum_distance(maximum_distances, contact, distance_ca)
+    
+    end = timer()
+    current_time = end - start
 
-                if distance_ca > 21:
-                    continue
-                
-            else:
-                continue              
+    return contacts, current_time, maximum_distances
+
+
+def contact_detection_tensor(protein, fast, maximum_distances, chunk=4096, compiled=False, threads=1, executor=None, topology=None, spheres=False, categories=None, interface=None, region=None, cutoffs=False):
+    """
+    Evaluates every atom pair of a chunk of residue pairs as one dense tensor.
+
+    The atoms of each residue are packed into a (residues, width, 3) array padded with nan (width is the
+    largest residue, at most 14 heavy atoms; the RNG pseudo-atom is handled by stacking_detection), so each
+    chunk of candidate residue pairs becomes a (chunk, width, width) distance tensor.
+    With compiled, the chunks are evaluated by the Numba kernel instead (if numba is installed).
+    With threads, chunks are evaluated in parallel by a thread pool.
+    With a process pool executor, the padded arrays are put into shared memory once and every worker
+    evaluates a tile of the candidate pairs (see tile_hits).
+    The topology tables (see tensor_topology) can be given, so the models of an ensemble compute them only once.
+    With spheres, the 21 A alpha carbon cutoff is replaced by the exact bound of sphere_pairs.
+    With categories (names of rules.category_names and "stacking"), only those contacts are searched for.
+    With interface (a list of (chain, chain) id pairs, or True for every pair of chains), only contacts between
+    residues of different chains are searched for (see interface_residues).
+    With region (residue rows, or a (residues,) bool mask, see region.py), only contacts between the residues of the region
+    and any other residue are searched for.
+    With cutoffs, residue pairs are also pruned by the alpha carbon cutoff of their residue types (rules.cutoffs).
+    """
+
+    start = timer()
+    
+    arrays = to_arrays(protein)
+    contacts = []
+    
+    mask = rules.category_mask(fast, categories)
+    selected, resnums, chains, padded_index, padded_types, ca_index = topology or tensor_topology(arrays, mask)
+    ca_coords = arrays.coords[ca_index].reshape(-1, 3)
+    padded_coords = where(padded_index[:, :, None] >= 0, arrays.coords[padded_index], nan)
+    
+    stacking = categories is None or "stacking" in categories
+    stackings = stacking_detection(arrays) if stacking else {}
+    
+    # candidate residue pairs: different residues with alpha carbons up to 21 A apart (or with close bounding spheres);
+    # with categories, only residues of the types that can form them, and only pairs of types that can form them together
+    # with interface, only residues near the bounding box of a partner chain, and only pairs of partner chains;
+    # with region, only pairs with a residue of the region, looked up around its residues;
+    # with cutoffs, only pairs within the alpha carbon cutoff of their residue types
+    types = arrays.residue_types[selected]
+    partners = rules.residue_partners(mask, stacking)
+    subset = arange(len(selected))
+    if categories is not None:
+        subset = subset[partners.any(axis=1)[types[subset]]]
+    if interface is not None:
+        near, chain_partners = interface_residues(arrays, selected, mask, stacking, interface)
+        subset = subset[near[subset]]
+    pair_cutoffs = where(partners, 21, -1) if categories is not None else None
+    if cutoffs:
+        pair_cutoffs = rules.cutoffs if pair_cutoffs is None else minimum(pair_cutoffs, rules.cutoffs)
+    in_region = None
+    if region is not None:
+        in_region = zeros(len(arrays.resnums), dtype=bool)
+        in_region[region] = True
+        in_region = in_region[selected]
+    if spheres:
+        pairs = sphere_pairs(arrays, selected, mask, stackings, subset, in_region)
+        ca_distances = neighbours.point_distances(ca_coords, pairs[:, 0], pairs[:, 1])
+    elif region is not None:
+        pairs, ca_distances = spatial.region_pairs(ca_coords[subset], flatnonzero(in_region[subset]), 21)
+        pairs = subset[pairs]
+    else:
+        pairs, ca_distances = spatial.tiled_pairs(ca_coords[subset], 21, *((types[subset], pair_cutoffs) if pair_cutoffs is not None else ()))
+        pairs = subset[pairs]
+    first, second = pairs[:, 0], pairs[:, 1]
+    different = (resnums[first] != resnums[second]) | (chains[first] != chains[second])
+    if pair_cutoffs is not None:
+        different &= ca_distances <= pair_cutoffs[types[first], types[second]]
+    if interface is not None:
+        residue_chain = arrays.residue_chain[selected]
+        different &= chain_partners[residue_chain[first], residue_chain[second]]
+    pairs, ca_distances = pairs[different], ca_distances[different]
+    helix = abs(resnums[pairs[:, 1]] - resnums[pairs[:, 0]]) <= 3
+    
+    # candidate pairs with an aromatic stacking
+    stacked = stacked_pairs(arrays, selected, pairs, stackings)
+    
+    def evaluate(begin):
+        return tensor_hits(padded_coords, padded_types, pairs[begin:begin + chunk], helix[begin:begin + chunk], mask, compiled, threads > 1)
+    
+    # chunks are evaluated by the thread pool (the kernels release the GIL) or the process pool, and merged
+    # back in their order, so each residue pair belongs to exactly one chunk
+    workers = executor._max_workers if executor else threads
+    if workers > 1: # at least one chunk per worker
+        chunk = max(1, min(chunk, -(-len(pairs) // workers)))
+    begins = range(0, len(pairs), chunk)
+    
+    blocks, pool = [], ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+    try:
+        if executor:
+            blocks, specs = shared.share(padded_coords=padded_coords, padded_types=padded_types, pairs=pairs, helix=helix)
+            results = executor.map(tile_hits, [(specs, begin, begin + chunk, mask, compiled) for begin in begins])
+        elif pool:
+            results = pool.map(evaluate, begins)
+        else:
+            results = map(evaluate, begins) # in this thread: Numba's parallel kernel must be launched from the main thread
+        
+        for begin, (pair, local1, local2, pair_distances, hit_categories) in zip(begins, results):
+            first, second = pairs[begin:begin + chunk, 0], pairs[begin:begin + chunk, 1]
+            bounds = searchsorted(pair, arange(len(first) + 1))
             
-            # CHECKING FOR AROMATIC STACKINGS
-            if residue1.ring and residue2.ring:
-                ring1, ring2 = residue1.atoms[-1], residue2.atoms[-1] # RNG atoms
-                distance = dist((ring1.x, ring1.y, ring1.z), (ring2.x, ring2.y, ring2.z))
-                angle = calc_angle(residue1.normal_vector, residue2.normal_vector)
-                if distance >= 2 and distance <= 5: # within aromatic stacking limits
-                    if (160 <= angle < 180) or (0 <= angle < 20):
-                        stack_type = "-parallel"
-                    elif (80 <= angle < 100):
-                        stack_type = "-perpendicular"
-                    else:
-                        stack_type = "-other"
-
-                    contact = Contact(protein.id, residue1.chain.id, residue1.resnum, residue1.resname, ring1.atomname, 
-                                    protein.id, residue2.chain.id, residue2.resnum, residue2.resname, ring2.atomname, 
-                                    float(f"{distance:.2f}"), "stacking"+stack_type, ring1, ring2)
-                    
+            for position in flatnonzero((bounds[1:] > bounds[:-1]) | stacked[begin:begin + chunk]).tolist():
+                index1, index2 = first[position], second[position]
+                row1, row2 = selected[index1], selected[index2]
+                
+                # CHECKING FOR AROMATIC STACKINGS
+                if (row1, row2) in stackings:
+                    distance, stack_type = stackings[row1, row2]
+                    contacts.append(array_contact(arrays, row1, row2, -1, -1, distance, stack_type))
+                
+                distance_ca = ca_distances[begin + position]
+                for hit, category in zip(range(bounds[position], bounds[position + 1]), hit_categories[bounds[position]:bounds[position + 1]].tolist()):
+                    atom_index1, atom_index2 = padded_index[index1, local1[hit]], padded_index[index2, local2[hit]]
+                    contact = array_contact(arrays, row1, row2, atom_index1, atom_index2, pair_distances[hit], rules.category_names[category])
                     contacts.append(contact)
                     
-            for atom1 in residue1.atoms:
-                for atom2 in residue2.atoms:
-                    name1 = f"{atom1.residue.resname}:{atom1.atomname}" # matches the pattern from contacts dictionary
-                    name2 = f"{atom2.residue.resname}:{atom2.atomname}"
-                    
-                    if name1 in conditions.contact_types and name2 in conditions.contact_types: # excludes the RNG atom and any different other
-                        
-                        distance = dist((atom1.x, atom1.y, atom1.z), (atom2.x, atom2.y, atom2.z))
-                        
-                        if distance <= 6: # max distance for contacts
-                            for contact_type, distance_range in conditions.categories.items():
-                                
-                                if not fast:
-                                    if contact_type == 'hydrogen_bond' or contact_type == 'hydrophobic':
-                                        continue                                
-                                
-                                if contact_type == 'hydrogen_bond' and (abs(residue2.resnum - residue1.resnum) <= 3): # skips alpha-helix for h-bonds
-                                    continue
-                                
-                                if distance_range[0] <= distance <= distance_range[1]: # fits the range
-                                    if conditions.contact_conditions[contact_type](name1, name2): # fits the type of contact
-                                                                                                
-                                        contact = Contact(protein.id, residue1.chain.id, residue1.resnum, residue1.resname, atom1.atomname, 
-                                                        protein.id, residue2.chain.id, residue2.resnum, residue2.resname, atom2.atomname, 
-                                                        float(f"{distance:.2f}"), contact_type, atom1, atom2)
-
-                                        contacts.append(contact)
-                                    
-                                        # ####################
-                                        # # BLOCK FOR CONSTRUCTING MAXIMUM DISTANCES LIST                   
-                                        if (residue1.resname, residue2.resname) not in maximum_distances:
-                                            maximum_distances[residue1.resname, residue2.resname] = [float(f"{distance_ca:.2f}"), float(f"{distance:.2f}"), residue1.resnum, residue2.resnum, protein.id, atom1.atomname, atom2.atomname, residue1.chain.id, residue2.chain.id, contact_type]
-                                            #print(f"Creating {residue1.resname, residue2.resname} : {distance_ca: .2f} | {residue1.resnum}, {residue2.resnum}, {protein.id}, {atom1.atomname}, {atom2.atomname}, {residue1.chain.id}, {residue2.chain.id}, {contact_types[0]}")
-                                        elif distance_ca > maximum_distances[residue1.resname, residue2.resname][0]:
-                                            #print(f"Changing {residue1.resname, residue2.resname} from {maximum_distances[residue1.resname, residue2.resname][0]} to {distance_ca: .2f}  | {residue1.resnum}, {residue2.resnum}, {protein.id}, {atom1.atomname}, {atom2.atomname}, {residue1.chain.id}, {residue2.chain.id}, {contact_types[0]}")
-                                            maximum_distances[residue1.resname, residue2.resname] = [float(f"{distance_ca:.2f}"), float(f"{distance:.2f}"), residue1.resnum, residue2.resnum, protein.id, atom1.atomname, atom2.atomname, residue1.chain.id, residue2.chain.id, contact_type]
-                                        # # ###################
-                                                                                                                
+                    record_maximum_distance(maximum_distances, contact, distance_ca)
+    finally:
+        if pool:
+            pool.shutdown()
+        shared.release(blocks, unlink=True)
+    
+    end = timer()
+    current_time = end - start
+
+    return contacts, current_time, maximum_distances
+
+
+def contact_detection_numba(protein, fast, maximum_distances, threads=1, executor=None, topology=None, spheres=False, categories=None, interface=None, region=None, cutoffs=False):
+    # the tensor engine with its atom pairs evaluated by the compiled kernel (NumPy when numba is not installed)
+    return contact_detection_tensor(protein, fast, maximum_distances, chunk=65536, compiled=True, threads=threads, executor=executor,
+                                    topology=topology, spheres=spheres, categories=categories, interface=interface, region=region, cutoffs=cutoffs)
+
+
+def sphere_pairs(arrays, selected, mask, stackings, subset=None, region=None):
+    """
+    Candidate residue pairs (positions in selected, sorted) from the bounding spheres of their contact-capable atoms:
+    a pair is kept unless the gap between its spheres is larger than the largest enabled category range for its two
+    residue types, which can't lose any contact. Pairs with an aromatic stacking are always kept.
+    With a subset (positions in selected), only pairs of its residues; with a region ((selected,) bool), only pairs with
+    at least one residue in it.
+    """
+
+    centres, radii = arrays.spheres()
+    centres, radii = centres[selected], radii[selected]
+    types = arrays.residue_types[selected]
+    reach = rules.residue_reach(mask)
+    
+    member = zeros(len(selected), dtype=bool)
+    member[arange(len(selected)) if subset is None else subset] = True
+    known = flatnonzero(~isnan(radii) & member)
+    cutoff = 2 * radii[known].max(initial=0) + reach.max()
+    if region is None:
+        pairs, centre_distances = spatial.kdtree_pairs(centres[known], cutoff)
+    else:
+        pairs, centre_distances = spatial.region_pairs(centres[known], flatnonzero(region[known]), cutoff)
+    pairs = known[pairs]
+    gaps = centre_distances - radii[pairs[:, 0]] - radii[pairs[:, 1]]
+    pairs = pairs[gaps <= reach[types[pairs[:, 0]], types[pairs[:, 1]]]]
+    
+    positions = full(len(arrays.resnums), -1)
+    positions[selected] = arange(len(selected))
+    stacking_pairs = positions[array(list(stackings), dtype=int).reshape(-1, 2)]
+    stacking_pairs = stacking_pairs[(stacking_pairs >= 0).all(axis=1)]
+    stacking_pairs = stacking_pairs[member[stacking_pairs].all(axis=1)]
+    if region is not None:
+        stacking_pairs = stacking_pairs[region[stacking_pairs].any(axis=1)]
+    
+    keys = unique(concatenate((pairs[:, 0] * len(selected) + pairs[:, 1], stacking_pairs[:, 0] * len(selected) + stacking_pairs[:, 1])))
+    return concatenate(((keys // len(selected))[:, None], (keys % len(selected))[:, None]), axis=1)
+
+
+def interface_residues(arrays, selected, mask, stacking, interface):
+    """
+    Residues near a chain interface: the bounding box of every chain is built from the bounding spheres of its
+    residues, pairs of chains whose boxes are farther apart than the largest enabled range (5 A at least with stackings)
+    are skipped, and a residue is near when its sphere is within that range of the box of a partner chain.
+
+    Args:
+        interface: List of (chain, chain) id pairs, or True for every pair of different chains.
+
+    Returns:
+        tuple: (selected,) True for the residues near an interface and the (chains, chains) partner chains
+        (indexed like chain_ids) whose boxes are close enough.
+    """
+
+    reach = rules.compile_rules(mask)[1].max(initial=0)
+    if stacking:
+        reach = max(reach, 5) # ring centroids lie inside the spheres of their atoms
+    
+    centres, radii = arrays.spheres()
+    centres, radii = centres[selected], radii[selected]
+    residue_chain = arrays.residue_chain[selected]
+    known = ~isnan(radii)
+    
+    chain_count = len(arrays.chain_ids)
+    lower, upper = full((chain_count, 3), inf), full((chain_count, 3), -inf)
+    minimum.at(lower, residue_chain[known], centres[known] - radii[known, None])
+    maximum.at(upper, residue_chain[known], centres[known] + radii[known, None])
+    
+    ids = arrays.chain_ids
+    if interface is True:
+        requested = ids[:, None] != ids[None, :]
+    else:
+        requested = zeros((chain_count, chain_count), dtype=bool)
+        for chain1, chain2 in interface:
+            requested |= ((ids[:, None] == chain1) & (ids[None, :] == chain2)) | ((ids[:, None] == chain2) & (ids[None, :] == chain1))
+    
+    # gap between boxes: the per-axis separation (0 when they overlap along that axis), inf for chains without residues
+    with errstate(invalid="ignore"):
+        separation = maximum(0, maximum(lower[:, None] - upper[None, :], lower[None, :] - upper[:, None]))
+        box_gaps = sqrt((separation * separation).sum(axis=2))
+    chain_partners = requested & (box_gaps <= reach)
+    
+    near = zeros(len(selected), dtype=bool)
+    for chain1, chain2 in zip(*chain_partners.nonzero()):
+        members = flatnonzero(known & (residue_chain == chain1))
+        separation = maximum(0, maximum(lower[chain2] - centres[members], centres[members] - upper[chain2]))
+        near[members[sqrt((separation * separation).sum(axis=1)) - radii[members] <= reach]] = True
+    
+    return near, chain_partners
+
+
+def tensor_topology(arrays, mask=None):
+    """
+    Coordinate-independent tables of the tensor engine: selected residue rows, their resnums and chains,
+    the (residues, width) padded atom indices and atom types (-1 for padding), and the alpha carbon atom indices.
+    Only atoms that can form contacts are packed; with a category mask, only those active for its categories
+    (see rules.compile_rules), so the padded width shrinks with the rules.
+    """
+
+    # same residues as the nested loop: it starts from residues[1:] and needs an alpha carbon (atoms[1])
+    sizes = arrays.residue_end - arrays.residue_start + arrays.ring
+    selected = flatnonzero(sizes > 1)
+    selected = selected[selected > 0]
+    resnums = arrays.resnums[selected].astype(int)
+    chains = arrays.chain_ids[arrays.residue_chain[selected]]
+    ca_index = arrays.residue_start[selected] + 1
+    
+    # atoms keep their order inside each residue, so contacts keep the order of the nested loop
+    atom_residue, local = spatial.expand_ranges(arrays.residue_end[selected] - arrays.residue_start[selected])
+    atom_index = arrays.residue_start[selected][atom_residue] + local
+    atom_types = arrays.atom_types[atom_index]
+    active = atom_types >= 0
+    if mask is not None:
+        active &= rules.compile_rules(mask)[0][atom_types]
+    atom_residue, atom_index = atom_residue[active], atom_index[active]
+    
+    counts = bincount(atom_residue, minlength=len(selected))
+    local = arange(len(atom_residue)) - (cumsum(counts) - counts)[atom_residue]
+    width = int(counts.max()) if len(counts) else 0
+    padded_index = full((len(selected), width), -1)
+    padded_index[atom_residue, local] = atom_index
+    padded_types = where(padded_index >= 0, arrays.atom_types[padded_index], -1)
+    
+    return selected, resnums, chains, padded_index, padded_types, ca_index
+
+
+def ensemble_detection(ensemble, fast, maximum_distances, contact_detection=contact_detection_tensor, skin=None):
+    """
+    Contacts of every model of an Ensemble with the tensor (or numba) engine, sharing the topology tables.
+    With a skin (in A), a Verlet neighbour list replaces the engine: it's rebuilt only when some atom has moved more
+    than half the skin, and in between only its pairs are measured (see neighbours.NeighbourList).
+
+    Returns:
+        tuple: List with the contacts of each model, time and maximum distances.
+    """
+
+    start = timer()
+    
+    topology = tensor_topology(ensemble.topology, rules.category_mask(fast))
+    neighbour_list = neighbours.NeighbourList(topology, fast, skin) if skin else None
+    models = []
+    for index in range(ensemble.model_count()):
+        if neighbour_list:
+            contacts, _, maximum_distances = neighbour_detection(ensemble.model(index), neighbour_list, maximum_distances)
+        else:
+            contacts, _, maximum_distances = contact_detection(ensemble.model(index), fast, maximum_distances, topology=topology)
+        models.append(contacts)
+    
+    end = timer()
+    current_time = end - start
+
+    return models, current_time, maximum_distances
+
+
+def neighbour_detection(arrays, neighbour_list, maximum_distances):
+    """
+    Contacts of one model or frame from a neighbour list built on the same topology (same contacts as the tensor engine).
+    """
+
+    start = timer()
+    
+    contacts = []
+    selected = neighbour_list.selected
+    pairs, ca_distances, pair, atom1, atom2, pair_distances, categories = neighbour_list.hits(arrays.coords)
+    
+    # candidate pairs with an aromatic stacking
+    stackings = stacking_detection(arrays)
+    stacked = stacked_pairs(arrays, selected, pairs, stackings)
+    
+    bounds = searchsorted(pair, arange(len(pairs) + 1))
+    for position in flatnonzero((bounds[1:] > bounds[:-1]) | stacked).tolist():
+        row1, row2 = selected[pairs[position, 0]], selected[pairs[position, 1]]
+        
+        # CHECKING FOR AROMATIC STACKINGS
+        if (row1, row2) in stackings:
+            distance, stack_type = stackings[row1, row2]
+            contacts.append(array_contact(arrays, row1, row2, -1, -1, distance, stack_type))
+        
+        distance_ca = ca_distances[position]
+        for hit in range(bounds[position], bounds[position + 1]):
+            contact = array_contact(arrays, row1, row2, atom1[hit], atom2[hit], pair_distances[hit], rules.category_names[categories[hit]])
+            contacts.append(contact)
+            
+            record_maximum_distance(maximum_distances, contact, distance_ca)
+    
     end = timer()
     current_time = end - start
 
     return contacts, current_time, maximum_distances
 
 
+def tensor_hits(padded_coords, padded_types, pairs, helix, mask, compiled=False, threaded=False):
+    """
+    Finds the contacts of a chunk of candidate residue pairs.
+
+    Returns:
+        tuple: Position of the residue pair in the chunk, positions of both atoms in their padded residues,
+        distance and category index of every contact, in the order of the nested loop.
+    """
+
+    first, second = pairs[:, 0], pairs[:, 1]
+    
+    if compiled and kernels.njit is not None:
+        return kernels.atom_pair_hits(padded_coords, padded_types, first, second, helix, mask, threaded)
+    
+    # all atom distances of the chunk at once
+    width = padded_types.shape[1]
+    squared = zeros((len(first), width, width))
+    for axis in range(3):
+        delta = padded_coords[first, :, axis][:, :, None] - padded_coords[second, :, axis][:, None, :]
+        squared += delta * delta
+    pair_distances = sqrt(squared)
+    
+    capable = padded_types >= 0
+    cutoff = rules.compile_rules(mask)[1].max(initial=0) # largest effective cutoff of the enabled categories (6 A with all of them)
+    close = (pair_distances <= cutoff) & capable[first][:, :, None] & capable[second][:, None, :]
+    pair, local1, local2 = close.nonzero() # ordered by residue pair, then atom of the first and of the second residue
+    pair_distances = pair_distances[pair, local1, local2]
+    
+    hits, categories = rules.classify(padded_types[first[pair], local1], padded_types[second[pair], local2], pair_distances, helix[pair], mask)
+    return pair[hits], local1[hits], local2[hits], pair_distances[hits], categories
+
+
+def tile_hits(task):
+    """
+    Process pool worker: attaches to the shared arrays and finds the contacts of one tile of candidate pairs.
+    Returns compact arrays (see tensor_hits). The kernel runs serially, the pool already uses every core.
+    """
+
+    specs, begin, end, mask, compiled = task
+    blocks, shared_arrays = shared.attach(specs)
+    
+    try:
+        pair, local1, local2, pair_distances, categories = tensor_hits(shared_arrays['padded_coords'], shared_arrays['padded_types'], shared_arrays['pairs'][begin:end],
+                                                                       shared_arrays['helix'][begin:end], mask, compiled, True)
+    finally:
+        del shared_arrays
+        shared.release(blocks)
+    
+    return pair.astype(int32), local1.astype(uint8), local2.astype(uint8), pair_distances, categories.astype(uint8)
+
+
+def array_contact(arrays, row1, row2, atom_index1, atom_index2, distance, contact_type):
+    # atom index -1 stands for the RNG pseudo-atom of aromatic residues
+    return Contact(arrays.id, intern(str(arrays.chain_ids[arrays.residue_chain[row1]])), int(arrays.resnums[row1]), rules.residue_names[arrays.residue_types[row1]],
+                   intern(str(arrays.atom_names[atom_index1])) if atom_index1 >= 0 else "RNG",
+                   intern(str(arrays.chain_ids[arrays.residue_chain[row2]])), int(arrays.resnums[row2]), rules.residue_names[arrays.residue_types[row2]],
+                   intern(str(arrays.atom_names[atom_index2])) if atom_index2 >= 0 else "RNG",
+                   float(f"{distance:.2f}"), contact_type, atom_index1, atom_index2)
+
+
+def residue_pair_contacts(protein, residue1, residue2, distance_ca, fast, maximum_distances, stacking=None):
+    contacts = []
+
+    # CHECKING FOR AROMATIC STACKINGS (found beforehand by stacking_detection)
+    if stacking:
+        contacts.append(stacking_contact(protein, residue1, residue2, *stacking))
+            
+    for atom1 in residue1.atoms:
+        for atom2 in residue2.atoms:
+            name1 = f"{atom1.residue.resname}:{atom1.atomname}" # matches the pattern from contacts dictionary
+            name2 = f"{atom2.residue.resname}:{atom2.atomname}"
+            
+            if name1 in conditions.contact_types and name2 in conditions.contact_types: # excludes the RNG atom and any different other
+                
+                distance = dist((atom1.x, atom1.y, atom1.z), (atom2.x, atom2.y, atom2.z))
+                
+                if distance <= 6: # max distance for contacts
+                    contacts.extend(atom_pair_contacts(protein, residue1, residue2, atom1, atom2, name1, name2, distance, distance_ca, fast, maximum_distances))
+
+    return contacts
+
+
+def stacking_contact(protein, residue1, residue2, distance, stack_type):
+    ring1, ring2 = residue1.atoms[-1], residue2.atoms[-1] # RNG atoms
+    
+    return Contact(protein.id, residue1.chain.id, residue1.resnum, residue1.resname, ring1.atomname, 
+                   residue2.chain.id, residue2.resnum, residue2.resname, ring2.atomname, 
+                   float(f"{distance:.2f}"), stack_type, ring1.index, ring2.index)
+
+
+def stacking_detection(arrays):
+    """
+    Finds the aromatic stackings between all the rings of a structure in one vectorized pass.
+
+    Args:
+        arrays (ProteinArrays): Structure with the ring centroids and normal vectors of its residues.
+
+    Returns:
+        dict: (row1, row2) residue rows (row1 < row2) to the (distance, stacking type) of every
+        pair of rings within the aromatic stacking limits.
+    """
+
+    rows = flatnonzero(arrays.ring)
+    pairs, distances = spatial.kdtree_pairs(arrays.ring_centroids[rows], 5)
+    within = distances >= 2 # within aromatic stacking limits
+    pairs, distances = rows[pairs[within]], distances[within]
+
+    normals1, normals2 = arrays.ring_normals[pairs[:, 0]], arrays.ring_normals[pairs[:, 1]]
+    with errstate(invalid="ignore"): # rounding may push the cosine past 1: nan angles are "other", as before
+        angles = degrees(arccos((normals1 * normals2).sum(axis=1) / (norm(normals1, axis=1) * norm(normals2, axis=1))))
+
+    stack_types = full(len(pairs), "stacking-other", dtype=object)
+    stack_types[(80 <= angles) & (angles < 100)] = "stacking-perpendicular"
+    stack_types[((160 <= angles) & (angles < 180)) | ((0 <= angles) & (angles < 20))] = "stacking-parallel"
+
+    return dict(zip(map(tuple, pairs.tolist()), zip(distances.tolist(), stack_types.tolist())))
+
+
+def stacked_pairs(arrays, selected, pairs, stackings):
+    # True for the candidate residue pairs (positions in selected, sorted) with an aromatic stacking
+    keys = selected[pairs[:, 0]] * len(arrays.resnums) + selected[pairs[:, 1]]
+    stacking_keys = array([row1 * len(arrays.resnums) + row2 for row1, row2 in stackings], dtype=int)
+    position = searchsorted(keys, stacking_keys)
+    found = position < len(keys)
+    found[found] = keys[position[found]] == stacking_keys[found]
+    stacked = zeros(len(pairs), dtype=bool)
+    stacked[position[found]] = True
+    return stacked
+
+
+def atom_pair_contacts(protein, residue1, residue2, atom1, atom2, name1, name2, distance, distance_ca, fast, maximum_distances):
+    contacts = []
+
+    for contact_type, distance_range in conditions.categories.items():
+        
+        if not fast:
+            if contact_type == 'hydrogen_bond' or contact_type == 'hydrophobic':
+                continue                                
+        
+        if contact_type == 'hydrogen_bond' and (abs(residue2.resnum - residue1.resnum) <= 3): # skips alpha-helix for h-bonds
+            continue
+        
+        if distance_range[0] <= distance <= distance_range[1]: # fits the range
+            if conditions.contact_conditions[contact_type](name1, name2): # fits the type of contact
+                                                                        
+                contact = Contact(protein.id, residue1.chain.id, residue1.resnum, residue1.resname, atom1.atomname, 
+                                residue2.chain.id, residue2.resnum, residue2.resname, atom2.atomname, 
+                                float(f"{distance:.2f}"), contact_type, atom1.index, atom2.index)
+
+                contacts.append(contact)
+            
+                record_maximum_distance(maximum_distances, contact, distance_ca)
+
+    return contacts
+
+
+def record_maximum_distance(maximum_distances, contact, distance_ca):
+    # ####################
+    # # BLOCK FOR CONSTRUCTING MAXIMUM DISTANCES LIST                   
+    pair = (contact.residue_name1, contact.residue_name2)
+    if pair not in maximum_distances or distance_ca > maximum_distances[pair][0]:
+        maximum_distances[pair] = [float(f"{distance_ca:.2f}"), contact.distance, contact.residue_num1, contact.residue_num2, contact.id, 
+                                   contact.atom1, contact.atom2, contact.chain1, contact.chain2, contact.type]
+    # # ###################
+
+
+def merge_maximum_distances(maximum_distances, other):
+    # max-reduction of the maximum distances found separately, with the rule of record_maximum_distance;
+    # on ties of the recorded (rounded) alpha carbon distance the contact merged first is kept
+    for pair, values in other.items():
+        if pair not in maximum_distances or values[0] > maximum_distances[pair][0]:
+            maximum_distances[pair] = values
+
+
+engines = {
+    'python': contact_detection,
+    'grid': contact_detection_grid,
+    'kdtree': contact_detection_kdtree,
+    'tensor': contact_detection_tensor,
+    'numba': contact_detection_numba,
+}
+
+
 def show_contacts(contacts):
     category_counts = {}
 
@@ -113,10 +687,3 @@ def show_contacts(contacts):
             for entry in contacts:
                 if entry.type == category:
                     print("\t",entry.print_text())
-
-def calc_angle(vector1, vector2):
-    dot_product = dot(vector1, vector2)
-    magnitude_product = norm(vector1) * norm(vector2) # normalizes the dot product
-    angle = arccos(dot_product / magnitude_product) # angle in radians   
-    
-    return degrees(angle)
@@ -0,0 +1,99 @@
+from math import sqrt
+from numpy import zeros, empty, cumsum, int64, float64
+
+try:
+    from numba import njit, prange
+except ImportError: # numba is optional: the tensor engine keeps its NumPy evaluation
+    njit = None
+
+import rules
+
+hydrogen_bond = rules.category_names.index('hydrogen_bond')
+
+
+def atom_pair_hits(padded_coords, padded_types, first, second, helix, mask, threaded=False):
+    """
+    Compiled counterpart of the NumPy chunk evaluation in contacts.contact_detection_tensor.
+
+    Args:
+        padded_coords (array): (residues, width, 3) atom coordinates, padded with nan.
+        padded_types (array): (residues, width) atom type ids, -1 for padding and atoms that form no contacts.
+        first, second (array): Padded residues of each candidate residue pair.
+        helix (array): True for pairs of residues up to 3 positions apart (no hydrogen bonds).
+        mask (int): Bitmask of the enabled categories (see rules.category_mask).
+        threaded (bool): Called from a thread pool: runs serially and without the GIL instead of with prange.
+
+    Returns:
+        tuple: Residue pair, atom positions, distance and category of every contact, ordered by
+        residue pair, atoms and category (the order of the nested loop).
+    """
+
+    kernel = pair_hits_nogil if threaded else pair_hits
+    reach = rules.compile_rules(mask)[1]
+    return kernel(padded_coords, padded_types, first, second, helix, rules.compatibility, rules.category_ranges, reach, mask, hydrogen_bond)
+
+
+if njit is not None:
+
+    @njit(nogil=True, cache=True)
+    def atom_hits(padded_coords, padded_types, residue1, residue2, helix, compatibility, ranges, reach, mask, hydrogen_bond, out, count):
+        # visits every atom pair of two residues: counts the contacts, and also stores them when out is given
+        width = padded_types.shape[1]
+        found = 0
+
+        for local1 in range(width):
+            type1 = padded_types[residue1, local1]
+            if type1 < 0:
+                continue
+
+            for local2 in range(width):
+                type2 = padded_types[residue2, local2]
+                if type2 < 0:
+                    continue
+
+                squared = 0.0
+                for axis in range(3):
+                    delta = padded_coords[residue1, local1, axis] - padded_coords[residue2, local2, axis]
+                    squared += delta * delta
+                distance = sqrt(squared)
+                if not distance <= reach[type1, type2]: # effective cutoff of the atom types (see rules.compile_rules)
+                    continue
+
+                allowed = compatibility[type1, type2] & mask
+                for category in range(ranges.shape[0]):
+                    if not (allowed >> category) & 1:
+                        continue
+                    if category == hydrogen_bond and helix: # skips alpha-helix for h-bonds
+                        continue
+                    if ranges[category, 0] <= distance <= ranges[category, 1]:
+                        if count >= 0:
+                            out[0][count + found] = local1
+                            out[1][count + found] = local2
+                            out[2][count + found] = category
+                            out[3][count + found] = distance
+                        found += 1
+
+        return found
+
+    def pair_hits(padded_coords, padded_types, first, second, helix, compatibility, ranges, reach, mask, hydrogen_bond):
+        pairs = len(first)
+        dummy = (empty(0, int64), empty(0, int64), empty(0, int64), empty(0, float64))
+
+        # first pass counts the contacts of every residue pair, second pass writes them at their offsets
+        counts = zeros(pairs, int64)
+        for pair in prange(pairs):
+            counts[pair] = atom_hits(padded_coords, padded_types, first[pair], second[pair], helix[pair], compatibility, ranges, reach, mask, hydrogen_bond, dummy, -1)
+
+        offsets = cumsum(counts) - counts
+        total = counts.sum()
+        out = (empty(total, int64), empty(total, int64), empty(total, int64), empty(total, float64))
+        hit_pairs = empty(total, int64)
+
+        for pair in prange(pairs):
+            atom_hits(padded_coords, padded_types, first[pair], second[pair], helix[pair], compatibility, ranges, reach, mask, hydrogen_bond, out, offsets[pair])
+            hit_pairs[offsets[pair]:offsets[pair] + counts[pair]] = pair
+
+        return hit_pairs, out[0], out[1], out[3], out[2]
+
+    pair_hits_nogil = njit(nogil=True)(pair_hits) # prange runs as range
+    pair_hits = njit(parallel=True, cache=True)(pair_hits)
@@ -1,27 +1,75 @@
 import parser
 import argparser
 import contacts
+import trajectory
+import occupancy
+import region
 
 from timeit import default_timer as timer
+from functools import partial
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from multiprocessing import cpu_count, Manager
+from os import path
 import resource
 
 def main():
 
     global_time_start = timer()
-    pdb_files, fast, core, show_contacts, mode = argparser.cl_parse()
+    pdb_files, fast, core, show_contacts, mode, arrays, engine, threads, models, skin, dcd_files, occupancy_file, spheres, categories, interface, region_specs, cutoffs = argparser.cl_parse()
     file_list = pdb_files
     maximum_distances = {}
+    contact_detection = detection_engine(engine, threads, spheres, categories, interface, cutoffs)
     
-    if mode == "Single":
+    if mode == "Single" and occupancy_file:
+        if core == 0:
+            core = cpu_count()
+        
+        # frames split across the processes, only the frequency of each contact comes back
+        for position, file in enumerate(file_list):
+            file_time_start = timer()
+            ensemble = trajectory.read_dcd(dcd_files[position], file) if dcd_files else parser.parse_ensemble(file)
+            occupancy_table, _, maximum_distances = occupancy.ensemble_occupancy(ensemble, fast, maximum_distances, core, skin, bitsets=False)
+            occupancy_table.write(f"{path.splitext(path.basename(file))[0]}_occupancy.tsv")
+            
+            file_time_end = timer()
+            file_time = file_time_end - file_time_start
+            print(ensemble.topology.id, ensemble.model_count(), len(occupancy_table.counts), f"{file_time:.4f}")
+    
+    elif mode == "Single" and models:
+        for position, file in enumerate(file_list):
+            file_time_start = timer()
+            ensemble = trajectory.read_dcd(dcd_files[position], file) if dcd_files else parser.parse_ensemble(file)
+            models_list, _, maximum_distances = contacts.ensemble_detection(ensemble, fast, maximum_distances, contact_detection, skin)
+            protein = ensemble.topology
+            
+            for index, contacts_list in enumerate(models_list):
+                if show_contacts:
+                    contacts.show_contacts(contacts_list)
+                print(f"{protein.id}:{index + 1}", protein.true_count(), len(contacts_list))
+                
+            file_time_end = timer()
+            file_time = file_time_end - file_time_start
+            print(protein.id, ensemble.model_count(), sum(len(contacts_list) for contacts_list in models_list), f"{file_time:.4f}")
+    
+    elif mode == "Single" and region_specs:
         for file in file_list:
             file_time_start = timer()
-            if file.endswith(".pdb"):
-                protein = parser.parse_pdb(file)
-            else:
-                protein = parser.parse_pdbx(file)
-            contacts_list, _, maximum_distances = contacts.contact_detection(protein, fast, maximum_distances)
+            query = region.RegionQuery(parse_file(file, arrays), fast, spheres, engine)
+            selection = query.select(region_specs)
+            contacts_list, _, maximum_distances = query.contacts(selection, maximum_distances)
+            
+            if show_contacts:
+                contacts.show_contacts(contacts_list)
+                
+            file_time_end = timer()
+            file_time = file_time_end - file_time_start
+            print(query.arrays.id, selection.sum(), len(contacts_list), f"{file_time:.4f}")
+    
+    elif mode == "Single":
+        for file in file_list:
+            file_time_start = timer()
+            protein = parse_file(file, arrays)
+            contacts_list, _, maximum_distances = contact_detection(protein, fast, maximum_distances)
             
             if show_contacts:
                 contacts.show_contacts(contacts_list)
@@ -30,25 +78,45 @@ def main():
             file_time = file_time_end - file_time_start
             print(protein.id, protein.true_count(), len(contacts_list), f"{file_time:.4f}")
                 
+    elif mode == "Shared":
+        if core == 0:
+            core = cpu_count()
+            
+        print(f"Starting processing with {core} cores per structure\n")
+        
+        # one structure at a time: its arrays go into shared memory and the workers split its residue pairs
+        with ProcessPoolExecutor(max_workers=core) as executor:
+            for file in file_list:
+                file_time_start = timer()
+                protein = parse_file(file, arrays)
+                contacts_list, _, maximum_distances = contact_detection(protein, fast, maximum_distances, executor=executor)
+                
+                if show_contacts:
+                    contacts.show_contacts(contacts_list)
+                    
+                file_time_end = timer()
+                file_time = file_time_end - file_time_start
+                print(protein.id, protein.true_count(), len(contacts_list), f"{file_time:.4f}")
+                
     elif mode == "Multi":
         if core == 0:
             core = cpu_count()
             
         print(f"Starting processing with {core} cores\n")      
         manager = Manager()
-        maximum_distances = manager.dict()
 
         progress_list = manager.list()
         lock = manager.Lock()
         
         #total_files = len(file_list)  
         with ProcessPoolExecutor(max_workers=core) as executor:
-            future_to_file = {executor.submit(process_file, file_path, fast, maximum_distances, lock, progress_list): file_path for file_path in file_list}
+            future_to_file = {executor.submit(process_file, file_path, fast, lock, progress_list, arrays, engine, threads, spheres, categories, interface, cutoffs): file_path for file_path in file_list}
             
             for future in as_completed(future_to_file):
                 
                 try:
-                    protein, contacts_list, process_time, maximum_distances = future.result()
+                    protein, contacts_list, process_time, file_maximum_distances = future.result()
+                    contacts.merge_maximum_distances(maximum_distances, file_maximum_distances)
                     
                     print(protein.id, protein.true_count(), len(contacts_list), f"{process_time:.4f}")
 
@@ -79,19 +147,18 @@ def main():
     maximum_distances = sorted(maximum_distances.items(), key=lambda x:x[1])
     print(maximum_distances)    
 
-def process_file(file_path, fast, maximum_distances, lock, progress_list):
+def process_file(file_path, fast, lock, progress_list, arrays, engine, threads, spheres, categories, interface, cutoffs):
 
     file_time_start = timer()
+    maximum_distances = {} # local to the worker, merged by the parent (a Manager dict would be an IPC round trip per contact)
     
     # Update progress list
     with lock:
         progress_list.append(1)
     try:
-        if file_path.endswith(".pdb"):
-            parsed_data = parser.parse_pdb(file_path)
-        else:
-            parsed_data = parser.parse_pdbx(file_path)
-        contacts_list, _, maximum_distances = contacts.contact_detection(parsed_data, fast, maximum_distances)
+        parsed_data = parse_file(file_path, arrays)
+        contact_detection = detection_engine(engine, threads, spheres, categories, interface, cutoffs)
+        contacts_list, _, maximum_distances = contact_detection(parsed_data, fast, maximum_distances)
         
         file_time_end = timer()
         file_time = file_time_end - file_time_start
@@ -101,6 +168,27 @@ def process_file(file_path, fast, maximum_distances, lock, progress_list):
     except KeyError as e:
         return (file_path, None, e)  # Return tuple with file_path, None result, and exception
 
+def detection_engine(engine, threads, spheres, categories, interface, cutoffs):
+    # contact detection function of the engine with the options of the command line (main and the Multi mode workers)
+    contact_detection = contacts.engines[engine]
+    if threads > 1:
+        contact_detection = partial(contact_detection, threads=threads)
+    if spheres:
+        contact_detection = partial(contact_detection, spheres=True)
+    if categories:
+        contact_detection = partial(contact_detection, categories=categories)
+    if interface is not None:
+        contact_detection = partial(contact_detection, interface=interface)
+    if cutoffs:
+        contact_detection = partial(contact_detection, cutoffs=True)
+    return contact_detection
+
+def parse_file(file_path, arrays):
+    if file_path.endswith(".pdb"):
+        return parser.parse_pdb_arrays(file_path) if arrays else parser.parse_pdb(file_path)
+    else:
+        return parser.parse_pdbx_arrays(file_path) if arrays else parser.parse_pdbx(file_path)
+
 def print_memory_usage():
     usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1000.0  # Convert to MB
     print(f"Current memory usage: {usage} MB")
@@ -0,0 +1,116 @@
+from numpy import zeros, sqrt, concatenate, flatnonzero, empty, where, nan, unique, int64
+
+import spatial
+import rules
+
+# largest alpha carbon distance of a candidate residue pair and largest atom distance of a contact
+ca_cutoff = 21
+atom_cutoff = 6
+
+
+class NeighbourList:
+    """
+    Verlet neighbour list for the models of an ensemble or the frames of a trajectory.
+
+    Keeps every candidate residue pair up to ca_cutoff + skin and, inside them, every atom pair that can form a
+    contact up to atom_cutoff + skin, taken from the coordinates it was built with. While no atom has moved more
+    than half the skin since then, no pair can have come closer than the cutoffs from outside the list, so the
+    contacts of a frame are found by measuring only the listed pairs.
+    """
+    def __init__(self, topology, fast, skin=2.0, chunk=4096):
+        self.selected, self.resnums, self.chains, self.padded_index, self.padded_types, self.ca_index = topology # see contacts.tensor_topology
+        self.mask = rules.category_mask(fast)
+        self.reach = rules.compile_rules(self.mask)[1]
+        self.skin = skin
+        self.chunk = chunk
+        self.atoms = unique(concatenate((self.padded_index[self.padded_index >= 0], self.ca_index))) # every atom that can take part in a contact, and the alpha carbons
+        self.builds = 0
+        self.reference = None
+
+    def stale(self, coords):
+        # true until built, and when some atom has moved more than half the skin since the last build
+        if self.reference is None:
+            return True
+        delta = coords[self.atoms] - self.reference
+        return (delta * delta).sum(axis=1).max(initial=0) > (self.skin / 2) ** 2
+
+    def build(self, coords):
+        self.reference = coords[self.atoms].copy()
+        self.builds += 1
+
+        # candidate residue pairs: different residues with alpha carbons up to ca_cutoff + skin apart
+        ca_coords = coords[self.ca_index].reshape(-1, 3)
+        pairs, _ = spatial.tiled_pairs(ca_coords, ca_cutoff + self.skin)
+        first, second = pairs[:, 0], pairs[:, 1]
+        different = (self.resnums[first] != self.resnums[second]) | (self.chains[first] != self.chains[second])
+        self.pairs = pairs[different]
+        self.helix = abs(self.resnums[self.pairs[:, 1]] - self.resnums[self.pairs[:, 0]]) <= 3
+
+        # atom pairs up to their effective cutoff (see rules.compile_rules) + skin, in the order of the nested loop
+        padded_coords = where(self.padded_index[:, :, None] >= 0, coords[self.padded_index], nan)
+        capable = self.padded_types >= 0
+        pair_list, local1_list, local2_list = [], [], []
+        for begin in range(0, len(self.pairs), self.chunk):
+            first, second = self.pairs[begin:begin + self.chunk, 0], self.pairs[begin:begin + self.chunk, 1]
+            pair_distances = padded_distances(padded_coords, first, second)
+
+            close = (pair_distances <= atom_cutoff + self.skin) & capable[first][:, :, None] & capable[second][:, None, :]
+            pair, local1, local2 = close.nonzero()
+            types1, types2 = self.padded_types[first[pair], local1], self.padded_types[second[pair], local2]
+            keep = pair_distances[pair, local1, local2] <= self.reach[types1, types2] + self.skin
+            pair_list.append(pair[keep] + begin)
+            local1_list.append(local1[keep])
+            local2_list.append(local2[keep])
+
+        pair = concatenate(pair_list) if pair_list else empty(0, int64)
+        local1 = concatenate(local1_list) if local1_list else empty(0, int64)
+        local2 = concatenate(local2_list) if local2_list else empty(0, int64)
+        self.pair = pair
+        self.atom1 = self.padded_index[self.pairs[pair, 0], local1]
+        self.atom2 = self.padded_index[self.pairs[pair, 1], local2]
+        self.types1 = self.padded_types[self.pairs[pair, 0], local1]
+        self.types2 = self.padded_types[self.pairs[pair, 1], local2]
+
+    def hits(self, coords):
+        """
+        Contacts of one frame, rebuilding the list first if it's stale.
+
+        Returns:
+            tuple: Candidate residue pairs of the frame (positions in selected) and their alpha carbon distances,
+            and the residue pair (position in the candidates), both atom indices, distance and category index of
+            every contact, in the order of the nested loop.
+        """
+
+        if self.stale(coords):
+            self.build(coords)
+
+        ca_distances = point_distances(coords, self.ca_index[self.pairs[:, 0]], self.ca_index[self.pairs[:, 1]])
+        candidate = ca_distances <= ca_cutoff
+
+        distances = point_distances(coords, self.atom1, self.atom2)
+        listed = flatnonzero((distances <= atom_cutoff) & candidate[self.pair])
+        hits, categories = rules.classify(self.types1[listed], self.types2[listed], distances[listed], self.helix[self.pair[listed]], self.mask)
+        hits = listed[hits]
+
+        # residue pairs renumbered among the candidates of this frame
+        position = candidate.cumsum() - 1
+        return self.pairs[candidate], ca_distances[candidate], position[self.pair[hits]], self.atom1[hits], self.atom2[hits], distances[hits], categories
+
+
+def point_distances(coords, index1, index2):
+    # componentwise, like spatial.tiled_pairs and the tensor engine, so the distances match them exactly
+    squared = zeros(len(index1))
+    for axis in range(3):
+        delta = coords[index1, axis] - coords[index2, axis]
+        squared += delta * delta
+    return sqrt(squared)
+
+
+def padded_distances(padded_coords, first, second):
+    # (pairs, width, width) atom distances of residue pairs, nan for padding
+    width = padded_coords.shape[1]
+    squared = zeros((len(first), width, width))
+    for axis in range(3):
+        delta = padded_coords[first, :, axis][:, :, None] - padded_coords[second, :, axis][:, None, :]
+        squared += delta * delta
+    return sqrt(squared)
@@ -0,0 +1,189 @@
+from timeit import default_timer as timer
+from concurrent.futures import ProcessPoolExecutor
+from numpy import array, concatenate, unique, bincount, zeros, empty, packbits, flatnonzero, int64, uint8, float64
+
+from contacts import tensor_topology, stacking_detection, stacked_pairs, array_contact, record_maximum_distance, merge_maximum_distances
+import neighbours
+import rules
+
+# contact types of the occupancy keys: the atom categories, then the aromatic stackings (between RNG pseudo-atoms)
+stacking_types = ["stacking-parallel", "stacking-perpendicular", "stacking-other"]
+contact_types = rules.category_names + stacking_types
+
+# state of each worker process, sent once by start_worker
+worker = {}
+
+
+class Occupancy:
+    """
+    Persistence table of the contacts of an ensemble or trajectory: every unique (atom pair, contact type) with the
+    number of frames where it occurs, the sum of its distances and, optionally, a bitset of those frames.
+    Atom contacts hold the atom indices of the topology, stackings the residue rows of both rings.
+    """
+    def __init__(self, topology, frame_count, index1, index2, types, counts, distance_sums, bits=None):
+        self.topology = topology             # ProteinArrays
+        self.frame_count = frame_count
+        self.index1 = index1                 # (contacts,) int64, atom index (residue row for stackings)
+        self.index2 = index2                 # (contacts,) int64, atom index (residue row for stackings)
+        self.types = types                   # (contacts,) int64, index in contact_types
+        self.counts = counts                 # (contacts,) int64, frames with the contact
+        self.distance_sums = distance_sums   # (contacts,) float64
+        self.bits = bits                     # (contacts, ceil(frames / 8)) uint8, bit f (numpy.packbits order) set if present in frame f
+
+    def frequencies(self):
+        return self.counts / max(self.frame_count, 1)
+
+    def summary(self):
+        # one row per contact, in the columns of Contact.print_values plus count, frequency and mean distance
+        topology = self.topology
+        rows = []
+        for index1, index2, contact_type, count, distance_sum in zip(self.index1.tolist(), self.index2.tolist(), self.types.tolist(),
+                                                                     self.counts.tolist(), self.distance_sums.tolist()):
+            if contact_type < len(rules.category_names):
+                row1, row2 = topology.atom_residue[index1], topology.atom_residue[index2]
+                contact = array_contact(topology, row1, row2, index1, index2, 0, contact_types[contact_type])
+            else:
+                contact = array_contact(topology, index1, index2, -1, -1, 0, contact_types[contact_type])
+            rows.append([contact.id, f"{contact.chain1}", f"{contact.residue_num1}{contact.residue_name1}:{contact.atom1}",
+                         f"{contact.chain2}", f"{contact.residue_num2}{contact.residue_name2}:{contact.atom2}", contact.type,
+                         count, f"{count / max(self.frame_count, 1):.4f}", f"{distance_sum / count:.2f}"])
+        return rows
+
+    def write(self, path):
+        with open(path, "w") as f:
+            f.write("id\tchain1\tatom1\tchain2\tatom2\ttype\tframes\tfrequency\tmean_distance\n")
+            for row in self.summary():
+                f.write("\t".join(map(str, row)) + "\n")
+
+
+def frame_keys(arrays, neighbour_list, maximum_distances):
+    """
+    Contacts of one frame as compact arrays, without Contact objects.
+
+    Returns:
+        tuple: First and second atom index (residue rows for stackings), contact type index and distance of every contact.
+    """
+
+    selected = neighbour_list.selected
+    pairs, ca_distances, pair, atom1, atom2, pair_distances, categories = neighbour_list.hits(arrays.coords)
+
+    # the maximum distances only change for contacts with alpha carbons farther apart than the recorded ones,
+    # so only those few become Contact objects, in the order of the nested loop
+    rows1, rows2 = selected[pairs[pair, 0]], selected[pairs[pair, 1]]
+    recorded = zeros((len(rules.residue_names), len(rules.residue_names)))
+    for (name1, name2), values in maximum_distances.items():
+        recorded[rules.residue_ids[name1], rules.residue_ids[name2]] = values[0]
+    hit_ca = ca_distances[pair]
+    for hit in flatnonzero(hit_ca > recorded[arrays.residue_types[rows1], arrays.residue_types[rows2]]).tolist():
+        contact = array_contact(arrays, rows1[hit], rows2[hit], atom1[hit], atom2[hit], pair_distances[hit], rules.category_names[categories[hit]])
+        record_maximum_distance(maximum_distances, contact, hit_ca[hit])
+
+    # stackings of the candidate pairs
+    stackings = stacking_detection(arrays)
+    stacked = flatnonzero(stacked_pairs(arrays, selected, pairs, stackings))
+    stacking_rows1, stacking_rows2 = selected[pairs[stacked, 0]], selected[pairs[stacked, 1]]
+    found = [stackings[row1, row2] for row1, row2 in zip(stacking_rows1.tolist(), stacking_rows2.tolist())]
+    stacking_distances = array([distance for distance, _ in found], dtype=float64)
+    stacking_kinds = array([contact_types.index(stack_type) for _, stack_type in found], dtype=int64)
+
+    return (concatenate((atom1, stacking_rows1)), concatenate((atom2, stacking_rows2)),
+            concatenate((categories, stacking_kinds)), concatenate((pair_distances, stacking_distances)))
+
+
+def start_worker(ensemble, fast, skin):
+    # process pool initializer: the topology (and the coordinates or the trajectory file) arrive once per worker
+    worker["ensemble"] = ensemble
+    worker["topology"] = tensor_topology(ensemble.topology, rules.category_mask(fast))
+    worker["fast"] = fast
+    worker["skin"] = skin
+
+
+def frame_block(task):
+    """
+    Reduces a block of consecutive frames into its occupancy: unique keys with their counts, distance sums and bitsets.
+    The block shares one neighbour list, so it's rebuilt only when its atoms move more than half the skin.
+    """
+
+    begin, end, bitsets = task
+    ensemble = worker["ensemble"]
+    neighbour_list = neighbours.NeighbourList(worker["topology"], worker["fast"], worker["skin"])
+    size = max(len(ensemble.topology.atom_names), len(ensemble.topology.resnums))
+    maximum_distances = {}
+
+    keys, distances, frames = [], [], []
+    for frame in range(begin, end):
+        index1, index2, types, frame_distances = frame_keys(ensemble.model(frame), neighbour_list, maximum_distances)
+        keys.append((index1 * size + index2) * len(contact_types) + types)
+        distances.append(frame_distances)
+        frames.append(zeros(len(index1), dtype=int64) + frame - begin)
+
+    keys, inverse = unique(concatenate(keys) if keys else empty(0, int64), return_inverse=True)
+    frames = concatenate(frames) if frames else empty(0, int64)
+    counts = bincount(inverse, minlength=len(keys))
+    distance_sums = bincount(inverse, concatenate(distances) if distances else empty(0), minlength=len(keys))
+
+    bits = None
+    if bitsets:
+        present = zeros((len(keys), end - begin), dtype=bool)
+        present[inverse, frames] = True
+        bits = packbits(present, axis=1)
+
+    return begin, keys, counts, distance_sums, bits, maximum_distances
+
+
+def ensemble_occupancy(ensemble, fast, maximum_distances, core=1, skin=2.0, block=64, bitsets=True):
+    """
+    Occupancy of every contact over all the models or frames of an ensemble or trajectory.
+
+    Blocks of consecutive frames are distributed across a process pool; each worker receives the topology once and
+    returns the compact occupancy of its blocks, never Contact lists. The blocks and the maximum distances of the
+    workers are merged here.
+
+    Args:
+        ensemble (Ensemble): Models or frames (trajectory.Trajectory reopens its file in every worker).
+        fast (bool): Same as the -fast flag.
+        maximum_distances (dict): Updated with the maximum distances of all the frames.
+        core (int): Number of processes (1 runs in this process).
+        skin (float): Skin of the neighbour lists, in A (0 measures every candidate pair in every frame).
+        block (int): Frames of each task (a multiple of 8, so the bitsets of the blocks are whole bytes).
+        bitsets (bool): Keeps the frames of every contact, not only their counts.
+
+    Returns:
+        tuple: Occupancy, time and maximum distances.
+    """
+
+    start = timer()
+
+    frame_count = ensemble.model_count()
+    block = max(8, block // 8 * 8)
+    tasks = [(begin, min(begin + block, frame_count), bitsets) for begin in range(0, frame_count, block)]
+
+    if core > 1:
+        with ProcessPoolExecutor(max_workers=core, initializer=start_worker, initargs=(ensemble, fast, skin)) as executor:
+            results = list(executor.map(frame_block, tasks))
+    else:
+        start_worker(ensemble, fast, skin)
+        results = list(map(frame_block, tasks))
+        worker.clear()
+
+    keys, inverse = unique(concatenate([result[1] for result in results]) if results else empty(0, int64), return_inverse=True)
+    counts = bincount(inverse, concatenate([result[2] for result in results]) if results else None, minlength=len(keys)).astype(int64)
+    distance_sums = bincount(inverse, concatenate([result[3] for result in results]) if results else None, minlength=len(keys))
+
+    bits = zeros((len(keys), (frame_count + 7) // 8), dtype=uint8) if bitsets else None
+    offset = 0
+    for begin, block_keys, _, _, block_bits, block_maximum_distances in results:
+        if bitsets:
+            bits[inverse[offset:offset + len(block_keys)], begin // 8:begin // 8 + block_bits.shape[1]] = block_bits
+        offset += len(block_keys)
+        merge_maximum_distances(maximum_distances, block_maximum_distances)
+
+    size = max(len(ensemble.topology.atom_names), len(ensemble.topology.resnums))
+    pair_keys, types = keys // len(contact_types), keys % len(contact_types)
+    occupancy = Occupancy(ensemble.topology, frame_count, pair_keys // size, pair_keys % size, types, counts, distance_sums, bits)
+
+    end = timer()
+    current_time = end - start
+
+    return occupancy, current_time, maximum_distances
+
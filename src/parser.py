@@ -1,8 +1,12 @@
-from classes import Protein, Chain, Residue, Atom
+from classes import Protein, Chain, Residue, Atom, ProteinArrays, Ensemble
+import rules
+import spatial
 
-from numpy import mean, array
+from numpy import mean, array, zeros, full, empty, nan, unique, flatnonzero, frombuffer, float64, int64, int32, int16, int8
 from numpy.linalg import svd
 from math import dist
+from array import array as column
+from sys import intern
 
 stacking = {
     'HIS':[10, 'CG','ND1','CE1','NE2','CD2'],
@@ -11,6 +15,12 @@ stacking = {
     'TYR':[12, 'CG','CD1','CE1','CZ','CE2','CD2'],
 }
 
+# ring atoms by atom type id, for the batched occupancy check of parse_*_arrays
+ring_types = zeros(len(rules.type_names), dtype=bool)
+for resname, (_, *ring_atoms) in stacking.items():
+    for atomname in ring_atoms:
+        ring_types[rules.type_ids[f"{resname}:{atomname}"]] = True
+
 
 def parse_pdb(pdb_file):
     """
@@ -35,7 +45,7 @@ def parse_pdb(pdb_file):
             line = line.strip()
             
             if line == "ENDMDL":
-                return current_protein
+                break
 
             if line.startswith("HEADER") and ("RNA" in line or "DNA" in line):
                 current_protein.id = pdb_file.split("/")[-1][:4]
@@ -49,11 +59,11 @@ def parse_pdb(pdb_file):
                 current_protein.set_title(line[10:])
                 
             elif line.startswith("ATOM"):
-                chain_id = line[21]
+                chain_id = intern(line[21])
                 resnum = int(line[22:26])
                 if resnum <= 0:
                     continue
-                resname = line[17:20]
+                resname = intern(line[17:20])
                 
                 if resname == "HIE" or resname == "HID":  # alternative names for protonated histidines
                     resname = "HIS" 
@@ -77,7 +87,7 @@ def parse_pdb(pdb_file):
                     atoms = []
                     current_residue = Residue(resnum, resname, atoms, current_chain, False, None)
                                                                 
-                atomname = line[12:16].replace(" ", "")
+                atomname = intern(line[12:16].replace(" ", ""))
                 if atomname == "OXT": # OXT is the C-terminal Oxygen atom. However, it exhibits the same properties of any Oxygen
                     atomname = atomname.replace("OXT","O")                
                 
@@ -92,26 +102,13 @@ def parse_pdb(pdb_file):
                             # print(current_residue.atoms[-1].x, current_residue.atoms[-1].y, current_residue.atoms[-1].z)
                             # print(x, y, z)
                             continue
-                    atom = Atom(atomname, x, y, z, occupancy, current_residue) # creates atom
+                    atom = Atom(atomname, x, y, z, occupancy, current_residue, len(current_protein.atoms)) # creates atom
                     current_residue.atoms.append(atom)
+                    current_protein.atoms.append(atom)
                 else:
                     continue
                     #print(atomname, occupancy, current_residue.resname, current_residue.resnum, current_chain.id, current_protein.id)
 
-                # CHECKING FOR AROMATICS
-                if current_residue.resname in stacking:
-                    allowed = stacking[current_residue.resname][1:]
-                    all_atoms_have_occupancy_one = all(atom.occupancy == 1 for atom in current_residue.atoms if atom.atomname in allowed)
-                    
-                    # if ring has only one conformation and the residue is complete (all atoms populated)
-                    if all_atoms_have_occupancy_one and len(current_residue.atoms) == stacking[current_residue.resname][0]:
-                        ring_atoms = array([[atom.x, atom.y, atom.z] for atom in current_residue.atoms[5:]]) # ignores [N, CA, C, O] and [RNG] atoms
-                        centroid_atom = centroid(current_residue, ring_atoms)
-                        current_residue.atoms.append(centroid_atom)
-                        current_residue.ring = True
-
-                        normal_vector = calc_normal_vector(ring_atoms)
-                        current_residue.normal_vector = normal_vector
 
             elif line.startswith("END"):  
                 # Handling cases where there is no ID
@@ -120,6 +117,7 @@ def parse_pdb(pdb_file):
                     id = id.split(".")[0]
                     current_protein.id = id  
 
+    add_rings(current_protein)
     return current_protein
 
 
@@ -175,14 +173,14 @@ def parse_pdbx(pdbx_file):
                 
                 model = int(line[model_index])
                 if model != 1: 
-                    return current_protein
+                    break
                 
-                chain_id = line[chain_index]
+                chain_id = intern(line[chain_index])
                 
                 resnum = int(line[resnum_index])
                 if resnum <= 0:
                     continue
-                resname = line[resname_index]
+                resname = intern(line[resname_index])
 
                 if resname == "HIE" or resname == "HID":  # alternative names for protonated histidines
                     resname = "HIS"  
@@ -208,7 +206,7 @@ def parse_pdbx(pdbx_file):
                     current_residue = Residue(resnum, resname, atoms, current_chain, False, None)
                     #current_chain.residues.append(current_residue)
                                                                 
-                atomname = line[atomname_index]
+                atomname = intern(line[atomname_index])
                 if atomname == "OXT": # OXT is the C-terminal Oxygen atom. However, it exhibits the same properties of any Oxygen
                     continue
                     atomname = atomname.replace("OXT","O")    
@@ -225,47 +223,426 @@ def parse_pdbx(pdbx_file):
                             print(current_residue.atoms[-1].x, current_residue.atoms[-1].y, current_residue.atoms[-1].z)
                             print(x, y, z)
                             continue
-                    atom = Atom(atomname, x, y, z, occupancy, current_residue) # creates atom
+                    atom = Atom(atomname, x, y, z, occupancy, current_residue, len(current_protein.atoms)) # creates atom
                     current_residue.atoms.append(atom)
+                    current_protein.atoms.append(atom)
                 else:
                     #print(atomname, occupancy, current_residue.resname, current_residue.resnum, current_chain.id, current_protein.id, x, y, z) 
                     continue
                                 
-                # CHECKING FOR AROMATICS
-                if current_residue.resname in stacking:
-                    allowed = stacking[current_residue.resname][1:]
-                    all_atoms_have_occupancy_one = all(atom.occupancy == 1 for atom in current_residue.atoms if atom.atomname in allowed)
-                    
-                    # if ring has only one conformation and the residue is complete (all atoms populated)
-                    if all_atoms_have_occupancy_one and len(current_residue.atoms) == stacking[current_residue.resname][0]:
-                        ring_atoms = array([[atom.x, atom.y, atom.z] for atom in current_residue.atoms[5:]]) # ignores [N, CA, C, O] and [RNG] atoms
-                        centroid_atom = centroid(current_residue, ring_atoms)
-                        current_residue.atoms.append(centroid_atom)
-                        current_residue.ring = True
-
-                        normal_vector = calc_normal_vector(ring_atoms)
-                        current_residue.normal_vector = normal_vector
 
             elif atominfo_block and line == "#":
                 current_chain.residues.append(current_residue) # appends the last residue
                 atominfo_block = False 
     
+    add_rings(current_protein)
     return current_protein
 
 
-def centroid(residue, ring_atoms):
-    centroid = mean(ring_atoms, axis = 0)
-    centroid_atom = Atom("RNG", centroid[0], centroid[1], centroid[2], 1, residue)
+def add_rings(protein):
+    # CHECKING FOR AROMATICS: all complete rings of the structure are finalized together
+    residues = list({id(residue): residue for residue in protein.get_residues()}.values()) # duplicated rows are the same residue
+    complete = []
+    for residue in residues:
+        if residue.resname in stacking and len(residue.atoms) >= stacking[residue.resname][0]:
+            allowed = stacking[residue.resname][1:]
+            # if ring has only one conformation and the residue is complete (all atoms populated);
+            # only its first atoms count, so later ones (OXT, hydrogens) don't undo a complete ring
+            if all(atom.occupancy == 1 for atom in residue.atoms[:stacking[residue.resname][0]] if atom.atomname in allowed):
+                complete.append(residue)
+
+    ring_atoms = [[(atom.x, atom.y, atom.z) for atom in residue.atoms[5:stacking[residue.resname][0]]] for residue in complete] # ignores [N, CA, C, O, CB] atoms
+    centroids, normal_vectors = ring_geometry(ring_atoms)
+
+    for residue, centroid, normal_vector in zip(complete, centroids.tolist(), normal_vectors):
+        residue.atoms.append(Atom("RNG", centroid[0], centroid[1], centroid[2], 1, residue)) # index -1: not in Protein.atoms
+        residue.ring = True
+        residue.normal_vector = normal_vector
+
+
+def ring_geometry(ring_atoms):
+    """
+    Computes the centroids and plane normal vectors of many rings in a few batched NumPy calls.
+
+    Args:
+        ring_atoms (list): Coordinates of each ring, as (atoms, 3) arrays or lists.
+
+    Returns:
+        tuple: (rings, 3) array of centroids and (rings, 3) array of normal vectors.
+    """
+
+    centroids = empty((len(ring_atoms), 3))
+    normal_vectors = empty((len(ring_atoms), 3))
+    sizes = array([len(ring) for ring in ring_atoms], dtype=int)
+
+    for size in unique(sizes): # one stacked SVD per ring size (5, 6, 7 or 9 atoms)
+        rings = flatnonzero(sizes == size)
+        stacked = array([ring_atoms[ring] for ring in rings], dtype=float64) # (rings, size, 3)
+        ring_centroids = mean(stacked, axis = 1)
+
+        # Use singular value decomposition (SVD) to calculate the plane
+        _, _, vh = svd(stacked - ring_centroids[:, None, :]) # vh = V^T
+        centroids[rings] = ring_centroids
+        normal_vectors[rings] = vh[:, 2] # The normal vector is the last row of the V^T matrix
+
+    return centroids, normal_vectors
+
+
+def parse_pdb_arrays(pdb_file, dtype=float64):
+    """
+    Parses a PDB file straight into a ProteinArrays, without Chain, Residue or Atom objects.
+    Follows parse_pdb rule by rule, so ProteinArrays.view() gives the same residues as parse_pdb.
+
+    Args:
+        pdb_file (str): PDB file name to parse.
+        dtype: Coordinate type (float64 or float32, which halves the coordinate memory).
+
+    Returns:
+        ProteinArrays: Columnar representation of the parsed protein.
+    """
+
+    protein_id, title = None, None
+    chain_ids = []
+    residues = [] # [resnum, resname, chain, start, end] records in Protein.get_residues() order
+    atom_names, atom_types, coords, occupancies, sources = [], column('h'), column('d'), column('d'), column('q')
+    record = -1 # position of the ATOM line in its model, kept as the source of each atom (see parse_ensemble)
+    current_chain = None
+    current_residue = None
+    
+    valid_residues =  ['ALA', 'CYS', 'ASP', 'GLU', 'PHE', 'GLY', 'HIS', 'ILE', 'LYS', 'LEU',
+                        'MET', 'ASN', 'PRO', 'GLN', 'ARG', 'SER', 'THR', 'VAL', 'TRP', 'TYR']
+
+    with open(pdb_file) as f:
+        for line in f:
+            line = line.strip()
+            
+            if line == "ENDMDL":
+                break
+
+            if line.startswith("HEADER") and ("RNA" in line or "DNA" in line):
+                protein_id = pdb_file.split("/")[-1][:4]
+                title = "DNA/RNA"
+                break
+            
+            elif line.startswith("HEADER"):
+                protein_id = line[62:]
+                
+            elif line.startswith("TITLE"):
+                title = line[10:] if title is None else title + " " + line[10:].strip()
+                
+            elif line.startswith("ATOM"):
+                record += 1
+                chain_id = intern(line[21])
+                resnum = int(line[22:26])
+                if resnum <= 0:
+                    continue
+                resname = intern(line[17:20])
+                
+                if resname == "HIE" or resname == "HID":  # alternative names for protonated histidines
+                    resname = "HIS" 
+                
+                if resname not in valid_residues:
+                    continue                       
+
+                if current_chain is None or chain_ids[current_chain] != chain_id:  # new chain
+                    chain_ids.append(chain_id)
+                    current_chain = len(chain_ids) - 1
+
+                if current_residue is None:  # new residue
+                    current_residue = [resnum, resname, current_chain, len(atom_names), len(atom_names)]
+                    residues.append(current_residue)
+                
+                if current_residue[0] != resnum:
+                    if current_residue[4] - current_residue[3] > 1:
+                        residues.append(current_residue)
+                    current_residue = [resnum, resname, current_chain, len(atom_names), len(atom_names)]
+                                                                
+                atomname = intern(line[12:16].replace(" ", ""))
+                if atomname == "OXT": # OXT is the C-terminal Oxygen atom. However, it exhibits the same properties of any Oxygen
+                    atomname = atomname.replace("OXT","O")                
+                
+                x, y, z = float(line[30:38]), float(line[38:46]), float(line[46:54])
+                occupancy = float(line[55:60])
+                
+                if occupancy >= 0.5: # ignores low quality atoms (arbitrary value!)
+                    if current_residue[4] > current_residue[3] and dist(coords[-3:], (x, y, z)) > 10:
+                        continue
+                    atom_names.append(atomname)
+                    atom_types.append(rules.type_ids.get(f"{current_residue[1]}:{atomname}", -1))
+                    coords.extend((x, y, z))
+                    occupancies.append(occupancy)
+                    sources.append(record)
+                    current_residue[4] += 1
+
+            elif line.startswith("END"):  
+                # Handling cases where there is no ID
+                if protein_id is None:
+                    id = str(pdb_file).split("/")[-1]
+                    id = id.split(".")[0]
+                    protein_id = id  
+
+    return build_arrays(protein_id, title, chain_ids, residues, atom_names, atom_types, coords, occupancies, sources, dtype)
+
+
+def parse_pdbx_arrays(pdbx_file, dtype=float64):
+    """
+    Parses a PDBx/mmCIF file straight into a ProteinArrays, without Chain, Residue or Atom objects.
+    Follows parse_pdbx rule by rule, so ProteinArrays.view() gives the same residues as parse_pdbx.
+
+    Args:
+        pdbx_file (str): PDBx/mmCIF file name to parse.
+        dtype: Coordinate type (float64 or float32, which halves the coordinate memory).
+
+    Returns:
+        ProteinArrays: Columnar representation of the parsed protein.
+    """
+            
+    valid_residues =  ['ALA', 'CYS', 'ASP', 'GLU', 'PHE', 'GLY', 'HIS', 'ILE', 'LYS', 'LEU',
+                        'MET', 'ASN', 'PRO', 'GLN', 'ARG', 'SER', 'THR', 'VAL', 'TRP', 'TYR']
+    
+    protein_id, title = None, None
+    chain_ids = []
+    residues = [] # [resnum, resname, chain, start, end] records in Protein.get_residues() order
+    atom_names, atom_types, coords, occupancies, sources = [], column('h'), column('d'), column('d'), column('q')
+    record = 0 # position of the ATOM line in its model, kept as the source of each atom (see parse_ensemble); the first ATOM line only ends the header
+    current_chain = None
+    current_residue = None
+    atomsite_block = False # _atom_site. lines
+    atominfo_block = False # ATOM        lines
+    atom_lines = []
+
+    with open(pdbx_file) as f:
+        for line in f:
+            line = line.strip()
+
+            if line.startswith("_entry.id"):
+                protein_id = line[-4:]
+                
+            elif line.startswith("TITLE"):
+                title = line[10:] if title is None else title + " " + line[10:].strip()
+                            
+            elif line.startswith("_atom_site.group_PDB"):
+                atomsite_block = True
+                line = line.split(".")[1]
+                atom_lines.append(line)
+                
+            elif atomsite_block and line.startswith("_atom_site"):
+                line = line.split(".")[1]
+                atom_lines.append(line)
+                
+            elif atomsite_block and line.startswith("ATOM"):                                
+                atomname_index = atom_lines.index("label_atom_id")
+                resname_index = atom_lines.index("label_comp_id")
+                chain_index = atom_lines.index("label_asym_id")
+                resnum_index = atom_lines.index("label_seq_id")
+                x_index = atom_lines.index("Cartn_x")
+                y_index = atom_lines.index("Cartn_y")
+                z_index = atom_lines.index("Cartn_z")
+                occupancy_index = atom_lines.index("occupancy")
+                model_index = atom_lines.index("pdbx_PDB_model_num")
+                alt_occupancy_index = atom_lines.index("label_alt_id") # . if occupancy == 1, varies otherwise
+                                                               
+                atomsite_block = False
+                atominfo_block = True
+                
+            elif line.startswith("ATOM") and atominfo_block:
+                line = line.split()
+                
+                model = int(line[model_index])
+                if model != 1: 
+                    break
+                record += 1
+                
+                chain_id = intern(line[chain_index])
+                
+                resnum = int(line[resnum_index])
+                if resnum <= 0:
+                    continue
+                resname = intern(line[resname_index])
+
+                if resname == "HIE" or resname == "HID":  # alternative names for protonated histidines
+                    resname = "HIS"  
+
+                if resname not in valid_residues:
+                    continue                            
+
+                if current_chain is None or chain_ids[current_chain] != chain_id:  # new chain
+                    chain_ids.append(chain_id)
+                    current_chain = len(chain_ids) - 1
+                    current_residue = None
+
+                if current_residue is None:  # new residue
+                    current_residue = [resnum, resname, current_chain, len(atom_names), len(atom_names)]
+                    residues.append(current_residue)
+                
+                if current_residue[0] != resnum:
+                    if current_residue[4] - current_residue[3] > 1:
+                        residues.append(current_residue)
+                    current_residue = [resnum, resname, current_chain, len(atom_names), len(atom_names)]
+                                                                
+                atomname = intern(line[atomname_index])
+                if atomname == "OXT": # OXT is the C-terminal Oxygen atom (skipped, as in parse_pdbx)
+                    continue
+                    
+                x, y, z = float(line[x_index]), float(line[y_index]), float(line[z_index])
+                occupancy = float(line[occupancy_index])
+                    
+                if occupancy >= 0.5 and (line[alt_occupancy_index] == "." or line[alt_occupancy_index] == "A"): # ignores low quality atoms (arbitrary value!)
+                    if current_residue[4] > current_residue[3]:
+                        distance = dist(coords[-3:], (x, y, z))
+                        if distance > 10:
+                            print(f"BIZARRE {distance:.3f}", atomname, occupancy, current_residue[1], current_residue[0], chain_ids[current_chain], protein_id)
+                            print(*coords[-3:])
+                            print(x, y, z)
+                            continue
+                    atom_names.append(atomname)
+                    atom_types.append(rules.type_ids.get(f"{current_residue[1]}:{atomname}", -1))
+                    coords.extend((x, y, z))
+                    occupancies.append(occupancy)
+                    sources.append(record)
+                    current_residue[4] += 1
+
+            elif atominfo_block and line == "#":
+                if current_residue is not None:
+                    residues.append(current_residue) # appends the last residue
+                atominfo_block = False 
     
-    return centroid_atom
+    return build_arrays(protein_id, title, chain_ids, residues, atom_names, atom_types, coords, occupancies, sources, dtype)
+
+
+def parse_ensemble(file_path):
+    """
+    Parses every model of a PDB or PDBx/mmCIF file (NMR ensembles): the topology is parsed once from the first model
+    by parse_pdb_arrays/parse_pdbx_arrays, the other models only contribute the coordinates of the same atoms.
+
+    Args:
+        file_path (str): PDB or PDBx/mmCIF file name to parse.
+
+    Returns:
+        Ensemble: Topology and (models, atoms, 3) coordinates of all the models.
+    """
+
+    if file_path.endswith(".pdb"):
+        topology, models = parse_pdb_arrays(file_path), read_pdb_models(file_path)
+    else:
+        topology, models = parse_pdbx_arrays(file_path), read_pdbx_models(file_path)
+
+    records = len(models[0]) if models else 0
+    if any(len(model) != records for model in models):
+        raise ValueError(f"Models of {file_path} have different atoms!")
+
+    # one text to float conversion for all the models, then the atoms kept by the topology
+    coords = array(models, dtype=float64).reshape(len(models), records, 3)[:, topology.source]
+
+    ring_centroids = full((len(models), len(topology.resnums), 3), nan)
+    ring_normals = full((len(models), len(topology.resnums), 3), nan)
+    for index, model_coords in enumerate(coords):
+        ring_centroids[index], ring_normals[index] = model_rings(topology, model_coords)
+
+    return Ensemble(topology, coords, ring_centroids, ring_normals)
+
+
+def model_rings(topology, coords):
+    # ring centroids and normals of every residue row (nan if not ring) for other coordinates of the same topology
+    rows = flatnonzero(topology.ring)
+    starts, ends = topology.residue_start[rows].tolist(), topology.residue_end[rows].tolist()
+    ring_centroids = full((len(topology.resnums), 3), nan)
+    ring_normals = full((len(topology.resnums), 3), nan)
+    if len(rows):
+        ring_centroids[rows], ring_normals[rows] = ring_geometry([coords[start + 5:end] for start, end in zip(starts, ends)]) # ignores [N, CA, C, O, CB] atoms
+
+    return ring_centroids, ring_normals
 
 
-def calc_normal_vector(ring_atoms):
-    centroid = mean(ring_atoms, axis = 0) # axis=0 -> mean through the columns
-    centered_ring_atoms = ring_atoms - centroid # normalizes to origin
+def read_pdb_models(pdb_file):
+    # coordinate fields of the ATOM lines of every model, as text
+    models, current = [], []
+
+    with open(pdb_file) as f:
+        for line in f:
+            if line.startswith("ATOM"):
+                current.append((line[30:38], line[38:46], line[46:54]))
+            elif line.startswith("ENDMDL"):
+                models.append(current)
+                current = []
+
+    if current:
+        models.append(current)
+
+    return models
+
+
+def read_pdb_records(pdb_file):
+    # position of every ATOM line among the ATOM and HETATM lines of the first model, and the number of those lines
+    records, count = [], 0
+
+    with open(pdb_file) as f:
+        for line in f:
+            if line.startswith("ATOM"):
+                records.append(count)
+                count += 1
+            elif line.startswith("HETATM"):
+                count += 1
+            elif line.startswith("ENDMDL"):
+                break
+
+    return array(records, dtype=int64), count
+
+
+def read_pdbx_models(pdbx_file):
+    # coordinate fields of the ATOM lines of every model, as text
+    models = {}
+    atom_lines, columns = [], None
+
+    with open(pdbx_file) as f:
+        for line in f:
+            if line.startswith("_atom_site."):
+                atom_lines.append(line.strip().split(".")[1])
+            elif line.startswith("ATOM") and atom_lines:
+                if columns is None:
+                    columns = [atom_lines.index(name) for name in ("pdbx_PDB_model_num", "Cartn_x", "Cartn_y", "Cartn_z")]
+                line = line.split()
+                models.setdefault(line[columns[0]], []).append((line[columns[1]], line[columns[2]], line[columns[3]]))
+
+    return list(models.values())
+
+
+def build_arrays(protein_id, title, chain_ids, residues, atom_names, atom_types, coords, occupancies, sources, dtype):
+    coords = frombuffer(coords, dtype=float64).reshape(-1, 3).astype(dtype, copy=False)
+    occupancies = frombuffer(occupancies, dtype=float64)
+    
+    resnums = array([residue[0] for residue in residues], dtype=int32)
+    residue_types = array([rules.residue_ids[residue[1]] for residue in residues], dtype=int8)
+    residue_chain = array([residue[2] for residue in residues], dtype=int32)
+    residue_start = array([residue[3] for residue in residues], dtype=int64)
+    residue_end = array([residue[4] for residue in residues], dtype=int64)
+    
+    atom_residue = full(len(atom_names), -1, dtype=int32)
+    for row in range(len(residues) - 1, -1, -1): # first row wins for duplicated residues
+        atom_residue[residue_start[row]:residue_end[row]] = row
+    
+    # CHECKING FOR AROMATICS: ring with only one conformation and residue complete (all atoms populated),
+    # judged on the first atoms of the residue (later ones, like OXT, don't undo a complete ring)
+    sizes = array([stacking[resname][0] if resname in stacking else 0 for _, resname, _, _, _ in residues], dtype=int64)
+    complete = (sizes > 0) & (residue_end - residue_start >= sizes)
+    candidates = flatnonzero(complete)
+    owner, local = spatial.expand_ranges(sizes[candidates])
+    index = residue_start[candidates][owner] + local
+    atom_types = frombuffer(atom_types, dtype=int16)
+    partial = (occupancies[index] != 1) & ring_types[atom_types[index]] & (atom_types[index] >= 0)
+    complete[candidates[owner[partial]]] = False
+    
+    ring = complete
+    ring_centroids = full((len(residues), 3), nan)
+    ring_normals = full((len(residues), 3), nan)
+    rows = flatnonzero(ring)
+    centroids, normals = ring_geometry([coords[start + 5:start + size] for start, size in zip(residue_start[rows].tolist(), sizes[rows].tolist())]) # ignores [N, CA, C, O, CB] atoms
+    ring_centroids[rows] = centroids
+    ring_normals[rows] = normals
     
-    # Use singular value decomposition (SVD) to calculate the plane
-    _, _, vh = svd(centered_ring_atoms) # vh = V^T
-    normal_vector = vh[2]  # The normal vector is the last row of the V^T matrix
+    # bounding sphere of the atoms of each residue that can form contacts, for the pruning of the sphere mode
+    sphere_centres, sphere_radii = spatial.range_spheres(coords, residue_start, residue_end, atom_types >= 0)
     
-    return normal_vector
\ No newline at end of file
+    return ProteinArrays(protein_id, title, coords, array(atom_names, dtype=str), atom_types, occupancies, atom_residue,
+                         resnums, residue_types, residue_chain, residue_start, residue_end, array(chain_ids, dtype=str),
+                         ring, ring_centroids, ring_normals, frombuffer(sources, dtype=int64), sphere_centres, sphere_radii)
@@ -0,0 +1,88 @@
+from numpy import asarray, zeros, arange, sort, searchsorted, sqrt, int64
+
+from classes import to_arrays
+from contacts import engines, tensor_topology
+import spatial
+import rules
+
+
+class RegionQuery:
+    """
+    Contacts between a region of one structure (a residue range, a list of residues or the residues near a point)
+    and the rest of it, for pipelines that query the same structure again and again (binding sites, active sites).
+
+    The topology tables of the tensor engine and the KD-tree of the atoms are built once, every query only looks up
+    the residue pairs around its region (see contacts.contact_detection_tensor).
+    """
+    def __init__(self, protein, fast, spheres=False, engine="numba"):
+        self.arrays = to_arrays(protein)
+        self.fast = fast
+        self.spheres = spheres
+        self.contact_detection = engines[engine] # tensor or numba
+        self.topology = tensor_topology(self.arrays, rules.category_mask(fast))
+        self.tree = None # atom KD-tree, built by the first sphere selection
+
+    def residue_range(self, chain, start, end):
+        # residue rows of a chain with resnums from start to end (both included)
+        arrays = self.arrays
+        return (arrays.chain_ids[arrays.residue_chain] == chain) & (arrays.resnums >= start) & (arrays.resnums <= end)
+
+    def residue_list(self, residues):
+        # residue rows of (chain, resnum) pairs
+        arrays = self.arrays
+        selection = zeros(len(arrays.resnums), dtype=bool)
+        chains = arrays.chain_ids[arrays.residue_chain]
+        for chain, resnum in residues:
+            selection |= (chains == chain) & (arrays.resnums == resnum)
+        return selection
+
+    def sphere(self, centre, radius):
+        # residue rows with an atom up to radius A from the centre; every row holding the atom is marked, since the
+        # parsers store some residues twice (the first residue of the structure, of every chain in PDBx files)
+        arrays = self.arrays
+        centre = asarray(centre, dtype=float)
+        if spatial.cKDTree is None:
+            atoms = arange(len(arrays.coords))
+        else:
+            if self.tree is None:
+                self.tree = spatial.cKDTree(arrays.coords)
+            atoms = asarray(self.tree.query_ball_point(centre, radius + spatial.boundary), dtype=int64)
+        delta = arrays.coords[atoms] - centre
+        atoms = sort(atoms[sqrt((delta * delta).sum(axis=1)) <= radius])
+        return searchsorted(atoms, arrays.residue_end) > searchsorted(atoms, arrays.residue_start)
+
+    def select(self, specs):
+        """
+        Union of region specifications, as parsed by argparser.region_spec.
+
+        Args:
+            specs (list): ("range", chain, start, end), ("residue", chain, resnum) or ("sphere", (x, y, z), radius) tuples.
+
+        Returns:
+            array: (residues,) bool, True for the residue rows in the region.
+        """
+
+        selection = zeros(len(self.arrays.resnums), dtype=bool)
+        for spec in specs:
+            if spec[0] == "range":
+                selection |= self.residue_range(*spec[1:])
+            elif spec[0] == "residue":
+                selection |= self.residue_list([spec[1:]])
+            else:
+                selection |= self.sphere(*spec[1:])
+        return selection
+
+    def contacts(self, region, maximum_distances=None):
+        """
+        Contacts with at least one residue in the region.
+
+        Args:
+            region (array): (residues,) bool mask or residue rows, from the selections of this class.
+            maximum_distances (dict, optional): Updated like in every engine.
+
+        Returns:
+            tuple: Contacts, time and maximum distances, like the engines.
+        """
+
+        maximum_distances = {} if maximum_distances is None else maximum_distances
+        return self.contact_detection(self.arrays, self.fast, maximum_distances, topology=self.topology, spheres=self.spheres, region=region)
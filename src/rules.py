@@ -0,0 +1,157 @@
+from os.path import dirname, join, exists
+from numpy import array, zeros, arange, uint8, savez, load, maximum
+
+import conditions
+import distances
+
+# the rules in conditions.py compiled once into integer tables:
+# every residue and every 'RES:ATOM' gets a type id and every pair of types a bitmask of the categories it can form
+
+residue_names = ['ALA', 'ARG', 'ASN', 'ASP', 'CYS', 'GLN', 'GLU', 'GLY', 'HIS', 'ILE',
+                 'LEU', 'LYS', 'MET', 'PHE', 'PRO', 'SER', 'THR', 'TRP', 'TYR', 'VAL']
+residue_ids = {name: index for index, name in enumerate(residue_names)}
+
+ring_residues = ['HIS', 'PHE', 'TRP', 'TYR'] # residues with the RNG pseudo-atom of the aromatic stackings
+
+type_names = list(conditions.contact_types)
+type_ids = {name: index for index, name in enumerate(type_names)}
+
+category_names = list(conditions.categories) # bit k of the masks is category_names[k]
+category_ranges = array([conditions.categories[category] for category in category_names], dtype=float)
+category_bits = arange(len(category_names))
+
+
+def compile_compatibility():
+    compatibility = zeros((len(type_names), len(type_names)), dtype=uint8)
+
+    for bit, category in enumerate(category_names):
+        condition = conditions.contact_conditions[category]
+        for type1, name1 in enumerate(type_names):
+            for type2, name2 in enumerate(type_names):
+                if condition(name1, name2):
+                    compatibility[type1, type2] |= 1 << bit
+
+    return compatibility
+
+
+compatibility = compile_compatibility()
+
+
+# binary cutoff table written by calibrate.py, loaded instead of distances.py when it's present; the engines prune
+# residue pairs with it only with -cutoffs (final_benchmark reads its own copy, final_benchmark/cutoffs.npz)
+cutoff_version = 1
+cutoff_file = join(dirname(__file__), "cutoffs.npz")
+
+
+def compile_cutoffs(margin=0.01):
+    # symmetric matrix of the maximum alpha carbon distances in distances.py (plus a safety margin), indexed by residue ids
+    cutoffs = zeros((len(residue_names), len(residue_names)))
+
+    for (res1, res2), distance in distances.distances.items():
+        cutoffs[residue_ids[res1], residue_ids[res2]] = distance + margin
+        cutoffs[residue_ids[res2], residue_ids[res1]] = distance + margin
+
+    return cutoffs
+
+
+def write_cutoffs(path, cutoffs, maxima, counts, levels, quantiles, margin):
+    """
+    Writes a versioned binary cutoff table (NumPy .npz).
+
+    Args:
+        cutoffs (array): (residues, residues) cutoffs used by the engines (maxima plus margin).
+        maxima (array): (residues, residues) maximum alpha carbon distance of the residue pairs with contacts.
+        counts (array): (residues, residues) number of residue pairs with contacts.
+        levels (array): Quantile levels.
+        quantiles (array): (levels, residues, residues) alpha carbon distance quantiles.
+        margin (float): Safety margin added to the maxima.
+    """
+
+    savez(path, version=array(cutoff_version), residue_names=array(residue_names), cutoffs=cutoffs, maxima=maxima,
+          counts=counts, levels=levels, quantiles=quantiles, margin=array(margin))
+
+
+def load_cutoffs(path):
+    # cutoffs of a table written by write_cutoffs, indexed by residue ids
+    with load(path) as table:
+        if int(table["version"]) != cutoff_version:
+            raise ValueError(f"{path} is a version {int(table['version'])} cutoff table, version {cutoff_version} is needed!")
+        if table["residue_names"].tolist() != residue_names:
+            raise ValueError(f"{path} has different residues!")
+        return table["cutoffs"]
+
+
+cutoffs = load_cutoffs(cutoff_file) if exists(cutoff_file) else compile_cutoffs()
+
+
+def category_mask(fast, categories=None):
+    if categories is not None: # only the requested categories (-types), whatever the -fast flag
+        return sum(1 << category_names.index(category) for category in categories if category in category_names)
+
+    mask = (1 << len(category_names)) - 1
+
+    if not fast: # same as the -fast flag: no hydrogen bonds and hydrophobic contacts
+        mask &= ~(1 << category_names.index('hydrogen_bond'))
+        mask &= ~(1 << category_names.index('hydrophobic'))
+
+    return mask
+
+
+def compile_rules(mask):
+    """
+    Compiles the rules of the enabled categories (see category_mask) for the engines.
+
+    Returns:
+        tuple: (types,) True for the atom types that can form some enabled category, and the (types, types)
+        effective cutoff of every pair of atom types: the largest range of the enabled categories it can form (0 if none).
+    """
+
+    enabled = ((compatibility & mask)[:, :, None] >> category_bits) & 1
+    reach = (enabled * category_ranges[:, 1]).max(axis=2)
+    active = reach.max(axis=1) > 0
+
+    return active, reach
+
+
+def residue_reach(mask):
+    # (residues, residues) largest distance of any enabled category between some atom of each residue type (0 if none)
+    type_residues = array([residue_ids[name.split(":")[0]] for name in type_names])
+    upper = compile_rules(mask)[1]
+
+    reach = zeros((len(residue_names), len(residue_names)))
+    maximum.at(reach, (type_residues[:, None], type_residues[None, :]), upper)
+    return reach
+
+
+def residue_partners(mask, stacking=True):
+    # (residues, residues) True for the residue types that can form some enabled category (or an aromatic stacking)
+    partners = residue_reach(mask) > 0
+    if stacking:
+        aromatic = array([name in ring_residues for name in residue_names])
+        partners |= aromatic[:, None] & aromatic[None, :]
+    return partners
+
+
+def classify(types1, types2, distances, helix, mask):
+    """
+    Classifies all candidate atom pairs at once.
+
+    Args:
+        types1, types2 (array): Type ids of the first and second atom of each pair.
+        distances (array): Distance of each pair.
+        helix (array): True for pairs of residues up to 3 positions apart (no hydrogen bonds).
+        mask (int): Bitmask of the enabled categories (see category_mask).
+
+    Returns:
+        tuple: Pair indices and category indices of every contact, ordered by pair and then
+        by category in the order of conditions.categories.
+    """
+
+    allowed = compatibility[types1, types2] & mask
+    fits_type = ((allowed[:, None] >> category_bits) & 1).astype(bool)
+    fits_range = (category_ranges[:, 0] <= distances[:, None]) & (distances[:, None] <= category_ranges[:, 1])
+
+    hits = fits_type & fits_range
+    hits[helix, category_names.index('hydrogen_bond')] = False # skips alpha-helix for h-bonds
+
+    return hits.nonzero()
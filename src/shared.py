@@ -0,0 +1,44 @@
+from multiprocessing import shared_memory
+from numpy import ndarray, dtype
+
+
+def share(**arrays):
+    """
+    Copies arrays into shared memory blocks, once, so process pool workers can attach to them instead of receiving copies.
+
+    Returns:
+        tuple: The blocks (release them with unlink=True when done) and the picklable specs for attach.
+    """
+
+    blocks, specs = [], {}
+
+    for name, values in arrays.items():
+        block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        ndarray(values.shape, values.dtype, buffer=block.buf)[...] = values
+        blocks.append(block)
+        specs[name] = (block.name, values.shape, values.dtype.str)
+
+    return blocks, specs
+
+
+def attach(specs):
+    """
+    Attaches to the blocks created by share. Returns the blocks and a dict of arrays backed by them (no copies).
+    """
+
+    blocks, arrays = [], {}
+
+    for name, (block_name, shape, type_code) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = ndarray(shape, dtype(type_code), buffer=block.buf)
+
+    return blocks, arrays
+
+
+def release(blocks, unlink=False):
+    # the arrays backed by the blocks must be gone before closing them
+    for block in blocks:
+        block.close()
+        if unlink:
+            block.unlink()
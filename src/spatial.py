@@ -0,0 +1,242 @@
+from itertools import product
+from numpy import asarray, floor, int64, argsort, unique, searchsorted, repeat, arange, cumsum, concatenate, lexsort, sqrt, empty, minimum, maximum, zeros, full, triu, bincount, nan, tile
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError: # scipy is optional: kdtree_pairs falls back to the cell list
+    cKDTree = None
+
+# KD-tree queries are made this much wider than their cutoff: the distances of the tree may round differently than
+# the componentwise distances of tiled_pairs and the nested loop, and pairs exactly at the cutoff must be kept
+boundary = 1e-6
+
+# half of the 26 neighbouring cells (plus the cell itself): every pair of cells is visited only once
+neighbour_offsets = [offset for offset in product((-1, 0, 1), repeat=3) if offset >= (0, 0, 0)]
+
+
+def grid_pairs(coords, cutoff):
+    """
+    Finds every pair of points closer than the cutoff using a uniform cell list.
+
+    Points are binned into cubic cells with the size of the cutoff, so only the
+    cell itself and its neighbours have to be checked for each point.
+
+    Args:
+        coords (array): (N, 3) array of coordinates (alpha carbons, atoms, ...).
+        cutoff (float): Maximum distance between two points of a pair.
+
+    Returns:
+        tuple: (M, 2) array of index pairs (i < j, sorted) and the (M,) array of their distances.
+    """
+
+    coords = asarray(coords, dtype=float)
+    if len(coords) < 2:
+        return empty((0, 2), dtype=int64), empty(0)
+
+    cells = floor((coords - coords.min(axis=0)) / cutoff).astype(int64) + 1 # +1 leaves an empty border, so offsets never wrap around
+    dims = cells.max(axis=0) + 2
+    keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+
+    order = argsort(keys, kind="stable")
+    cell_keys, cell_starts, cell_counts = unique(keys[order], return_index=True, return_counts=True)
+
+    first, second = [], []
+    for dx, dy, dz in neighbour_offsets:
+        neighbour_keys = cell_keys + (dx * dims[1] + dy) * dims[2] + dz
+        position = searchsorted(cell_keys, neighbour_keys)
+        position[position == len(cell_keys)] = 0
+        found = cell_keys[position] == neighbour_keys
+
+        cell1, cell2 = found.nonzero()[0], position[found]
+        starts1, counts1 = cell_starts[cell1], cell_counts[cell1]
+        starts2, counts2 = cell_starts[cell2], cell_counts[cell2]
+
+        # expands every pair of cells into all the pairs of their members
+        owner, local = expand_ranges(counts1 * counts2)
+        if len(owner) == 0:
+            continue
+        index1 = starts1[owner] + local // counts2[owner]
+        index2 = starts2[owner] + local % counts2[owner]
+
+        if (dx, dy, dz) == (0, 0, 0): # same cell: keeps each pair once and skips the point itself
+            keep = index1 < index2
+            index1, index2 = index1[keep], index2[keep]
+
+        first.append(order[index1])
+        second.append(order[index2])
+
+    if not first:
+        return empty((0, 2), dtype=int64), empty(0)
+
+    first, second = concatenate(first), concatenate(second)
+    first, second = minimum(first, second), maximum(first, second)
+
+    delta = coords[first] - coords[second]
+    distances = sqrt((delta * delta).sum(axis=1))
+    within = distances <= cutoff
+    first, second, distances = first[within], second[within], distances[within]
+
+    sorting = lexsort((second, first))
+    pairs = concatenate((first[sorting, None], second[sorting, None]), axis=1)
+
+    return pairs, distances[sorting]
+
+
+def tiled_pairs(coords, cutoff, types=None, cutoffs=None, block=2048):
+    """
+    Finds every pair of points closer than the cutoff by comparing all of them, one block of points against another.
+
+    Only (block, block) distance tiles are kept in memory, so the memory stays flat for any number of points.
+
+    Args:
+        coords (array): (N, 3) array of coordinates.
+        cutoff (float): Maximum distance between two points of a pair.
+        types (array, optional): Type id of every point.
+        cutoffs (array, optional): Additional maximum distance for every pair of types (cutoffs[type1, type2]).
+        block (int): Number of points of each block.
+
+    Returns:
+        tuple: (M, 2) array of index pairs (i < j, sorted) and the (M,) array of their distances.
+    """
+
+    coords = asarray(coords, dtype=float)
+    first, second, found = [], [], []
+
+    for start1 in range(0, len(coords), block):
+        block1 = coords[start1:start1 + block]
+
+        for start2 in range(start1, len(coords), block):
+            block2 = coords[start2:start2 + block]
+
+            squared = zeros((len(block1), len(block2)))
+            for axis in range(3):
+                delta = block1[:, axis, None] - block2[None, :, axis]
+                squared += delta * delta
+            distances = sqrt(squared)
+
+            within = distances <= cutoff
+            if types is not None:
+                within &= distances <= cutoffs[types[start1:start1 + block, None], types[None, start2:start2 + block]]
+            if start1 == start2: # same block: keeps each pair once and skips the point itself
+                within = triu(within, 1)
+
+            index1, index2 = within.nonzero()
+            first.append(index1 + start1)
+            second.append(index2 + start2)
+            found.append(distances[index1, index2])
+
+    if not first:
+        return empty((0, 2), dtype=int64), empty(0)
+
+    first, second, distances = concatenate(first).astype(int64), concatenate(second).astype(int64), concatenate(found)
+
+    sorting = lexsort((second, first))
+    pairs = concatenate((first[sorting, None], second[sorting, None]), axis=1)
+
+    return pairs, distances[sorting]
+
+
+def range_spheres(coords, starts, ends, mask):
+    """
+    Bounding sphere of the masked points of every range coords[start:end]: centroid and distance to its farthest point.
+
+    Returns:
+        tuple: (ranges, 3) centres and (ranges,) radii, nan for ranges without masked points.
+    """
+
+    owner, local = expand_ranges(ends - starts)
+    index = starts[owner] + local
+    kept = mask[index]
+    owner, index = owner[kept], index[kept]
+
+    counts = bincount(owner, minlength=len(starts))
+    centres = full((len(starts), 3), nan)
+    filled = counts > 0
+    for axis in range(3):
+        centres[filled, axis] = bincount(owner, coords[index, axis], minlength=len(starts))[filled] / counts[filled]
+
+    delta = coords[index] - centres[owner]
+    radii = full(len(starts), nan)
+    squared = zeros(len(starts))
+    maximum.at(squared, owner, (delta * delta).sum(axis=1))
+    radii[filled] = sqrt(squared[filled])
+
+    return centres, radii
+
+
+def expand_ranges(counts):
+    """
+    Expands ranges of the given sizes: for every element, the range it belongs to and its position inside it.
+    """
+
+    owner = repeat(arange(len(counts)), counts)
+    local = arange(len(owner)) - repeat(cumsum(counts) - counts, counts)
+
+    return owner, local
+
+
+def kdtree_pairs(coords, cutoff):
+    """
+    Finds every pair of points closer than the cutoff with a single KD-tree query.
+
+    Same output as grid_pairs, which is used instead when scipy is not installed.
+    """
+
+    coords = asarray(coords, dtype=float)
+    if cKDTree is None:
+        return grid_pairs(coords, cutoff)
+    if len(coords) < 2:
+        return empty((0, 2), dtype=int64), empty(0)
+
+    tree = cKDTree(coords)
+    pairs = tree.query_pairs(cutoff + boundary, output_type="ndarray").astype(int64) # i < j, unordered
+    pairs = pairs.reshape(-1, 2)
+    pairs = pairs[lexsort((pairs[:, 1], pairs[:, 0]))]
+
+    return pairs_within(coords, pairs[:, 0], pairs[:, 1], cutoff)
+
+
+def region_pairs(coords, queries, cutoff):
+    """
+    Finds every pair of points closer than the cutoff with at least one of the points among the queries,
+    by looking up the neighbours of the queries only (in a KD-tree, or all the points when scipy is not installed).
+
+    Args:
+        coords (array): (N, 3) array of coordinates.
+        queries (array): Indices of the query points.
+        cutoff (float): Maximum distance between two points of a pair.
+
+    Returns:
+        tuple: (M, 2) array of index pairs (i < j, sorted) and the (M,) array of their distances, computed like tiled_pairs.
+    """
+
+    coords = asarray(coords, dtype=float)
+    queries = unique(asarray(queries, dtype=int64))
+    if len(coords) < 2 or len(queries) == 0:
+        return empty((0, 2), dtype=int64), empty(0)
+
+    if cKDTree is not None:
+        found = cKDTree(coords).query_ball_point(coords[queries], cutoff + boundary, return_sorted=False)
+        counts = asarray([len(neighbours) for neighbours in found], dtype=int64)
+        first, second = repeat(queries, counts), concatenate([asarray(neighbours, dtype=int64) for neighbours in found])
+    else:
+        first, second = repeat(queries, len(coords)), tile(arange(len(coords)), len(queries))
+
+    first, second = minimum(first, second), maximum(first, second)
+    keys = unique((first * len(coords) + second)[first != second])
+    first, second = keys // len(coords), keys % len(coords)
+
+    return pairs_within(coords, first, second, cutoff)
+
+
+def pairs_within(coords, first, second, cutoff):
+    # pairs of a KD-tree query (made boundary wider than the cutoff) whose distances, computed like tiled_pairs, are within the cutoff
+    squared = zeros(len(first))
+    for axis in range(3):
+        delta = coords[first, axis] - coords[second, axis]
+        squared += delta * delta
+    distances = sqrt(squared)
+
+    within = distances <= cutoff
+    pairs = concatenate((first[within, None], second[within, None]), axis=1)
+    return pairs, distances[within]
@@ -0,0 +1,100 @@
+from os.path import getsize
+from numpy import memmap, frombuffer, dtype, empty, float64, int32
+
+from classes import Ensemble
+import parser
+
+
+class DCD:
+    """
+    Memory-mapped CHARMM/NAMD/X-PLOR DCD trajectory: frames are read from disk only when they are asked for,
+    so the file never has to fit in memory.
+    """
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, "rb") as f:
+            order = "<" if frombuffer(f.read(4), "<i4")[0] == 84 else ">" # Fortran record marker: 84 byte first record
+            header = f.read(88)
+            if header[:4] != b"CORD":
+                raise ValueError(f"{path} is not a DCD file!")
+            control = frombuffer(header[4:84], order + "i4")
+
+            title_size = frombuffer(f.read(4), order + "i4")[0]
+            f.seek(title_size + 4, 1)
+            self.atom_count = int(frombuffer(f.read(12), order + "i4")[1])
+            offset = f.tell()
+
+        if control[8] > 0:
+            raise ValueError(f"{path} has fixed atoms, which are not supported!")
+
+        # one record per frame: unit cell (CHARMM only, if flagged), then x, y and z in float32 between record markers
+        fields = []
+        charmm = control[19] != 0
+        if charmm and control[10]:
+            fields += [("cell_start", order + "i4"), ("cell", order + "f8", 6), ("cell_end", order + "i4")]
+        for axis in ("x", "y", "z") + (("w",) if charmm and control[11] else ()):
+            fields += [(axis + "_start", order + "i4"), (axis, order + "f4", self.atom_count), (axis + "_end", order + "i4")]
+        frame_type = dtype(fields)
+
+        frame_count = (getsize(path) - offset) // frame_type.itemsize # nset is not reliable in files still being written
+        self.frames = memmap(path, dtype=frame_type, mode="r", offset=offset, shape=(frame_count,))
+        if frame_count and self.frames[0]["x_start"] != 4 * self.atom_count:
+            raise ValueError(f"{path} has an unexpected frame layout!")
+
+    def __reduce__(self):
+        # process pool workers reopen the file instead of receiving its frames
+        return DCD, (self.path,)
+
+    def frame_count(self):
+        return len(self.frames)
+
+    def coords(self, index, atoms):
+        # (atoms, 3) coordinates of the given atoms in one frame, the only part of the file that is read
+        frame = self.frames[index]
+        coords = empty((len(atoms), 3), dtype=float64)
+        for axis, name in enumerate("xyz"):
+            coords[:, axis] = frame[name][atoms]
+        return coords
+
+
+class Trajectory(Ensemble):
+    """
+    Ensemble whose models are the frames of a DCD trajectory, with the topology parsed from a companion PDB
+    (the ATOM and HETATM records of the PDB are the atoms of the DCD, in the same order).
+    Coordinates and rings of a frame are computed when the frame is asked for.
+    """
+    def __init__(self, topology, dcd, atoms):
+        self.topology = topology
+        self.dcd = dcd
+        self.atoms = atoms # (atoms,) int32, DCD atom of every topology atom
+
+    def model_count(self):
+        return self.dcd.frame_count()
+
+    def model(self, index):
+        coords = self.dcd.coords(index, self.atoms)
+        ring_centroids, ring_normals = parser.model_rings(self.topology, coords)
+        return self.with_coords(coords, ring_centroids, ring_normals)
+
+
+def read_dcd(dcd_file, pdb_file):
+    """
+    Opens a DCD trajectory with the topology of its companion PDB file.
+
+    Args:
+        dcd_file (str): DCD trajectory file name.
+        pdb_file (str): PDB file with the atoms of the trajectory (first model), parsed by parser.parse_pdb_arrays.
+
+    Returns:
+        Trajectory: Ensemble with one model per frame, read lazily.
+    """
+
+    topology = parser.parse_pdb_arrays(pdb_file)
+    records, record_count = parser.read_pdb_records(pdb_file)
+    dcd = DCD(dcd_file)
+
+    if record_count != dcd.atom_count:
+        raise ValueError(f"{dcd_file} has {dcd.atom_count} atoms but {pdb_file} has {record_count}!")
+
+    return Trajectory(topology, dcd, records[topology.source].astype(int32))
@@ -1,39 +1,51 @@
 from math import dist
 from timeit import default_timer as timer
-from numpy import dot, arccos, degrees
+from numpy import dot, arccos, degrees, array, zeros, sqrt, flatnonzero, nan
 from numpy.linalg import norm
 
 from classes import Contact
+from parser import residue_codes
 import conditions
 import final_distances
 
+
+def compile_cutoffs():
+    # symmetric matrix of the maximum alpha carbon distances, indexed by the residue codes of the parser
+    cutoffs = zeros((len(residue_codes), len(residue_codes)))
+    
+    for (res1, res2), distance in final_distances.distances.items():
+        cutoffs[residue_codes[res1], residue_codes[res2]] = distance + 0.01
+        cutoffs[residue_codes[res2], residue_codes[res1]] = distance + 0.01
+    
+    return cutoffs
+
+
+cutoffs = compile_cutoffs()
+
+
 def contact_detection(protein, fast):
     start = timer()
     
     residues = list(protein.get_residues())
     contacts = []
     
-    for i, residue1 in enumerate(residues[1:]):
-        for j, residue2 in enumerate(residues[i+1:], start=i+1):
+    # alpha carbons (atoms[1]) and codes of all residues: residues without one get nan and never pass the prefilter
+    ca_coords = array([(residue.atoms[1].x, residue.atoms[1].y, residue.atoms[1].z) if len(residue.atoms) > 1 else (nan, nan, nan)
+                       for residue in residues]).reshape(-1, 3)
+    codes = array([residue.code for residue in residues], dtype=int)
+    
+    for i, residue1 in enumerate(residues[1:], start=1):
+        
+        # the CA prefilter against every following residue in one comparison (the residue itself is skipped below)
+        delta = ca_coords[i:] - ca_coords[i]
+        distances_ca = sqrt((delta * delta).sum(axis=1))
+        close = flatnonzero((distances_ca <= 21) & (distances_ca <= cutoffs[codes[i], codes[i:]])) + i
+        
+        for residue2 in map(residues.__getitem__, close.tolist()):
             
             if residue1.resnum == residue2.resnum and residue1.chain.id == residue2.chain.id: # ignores same residue
                 continue
             
-            if len(residue1.atoms) > 1 and len(residue2.atoms) > 1:
-                ca1, ca2 = residue1.atoms[1], residue2.atoms[1] # alpha carbons
-
-                distance_ca = dist((ca1.x, ca1.y, ca1.z), (ca2.x, ca2.y, ca2.z))
-            
-                pair = tuple(sorted((residue1.resname, residue2.resname)))
-                
-                if distance_ca > 21:
-                    continue
-                elif distance_ca > (final_distances.distances[pair] + 0.01):
-                   continue
-
-            else:
-                continue              
-            
             # CHECKING FOR AROMATIC STACKINGS
             if residue1.ring and residue2.ring:
                 ring1, ring2 = residue1.atoms[-1], residue2.atoms[-1] # RNG atoms
@@ -11,6 +11,10 @@ stacking = {
     'TYR':[12, 'CG','CD1','CE1','CZ','CE2','CD2'],
 }
 
+residue_names = ['ALA', 'ARG', 'ASN', 'ASP', 'CYS', 'GLN', 'GLU', 'GLY', 'HIS', 'ILE',
+                 'LEU', 'LYS', 'MET', 'PHE', 'PRO', 'SER', 'THR', 'TRP', 'TYR', 'VAL']
+residue_codes = {name: code for code, name in enumerate(residue_names)} # integer type of every residue
+
 
 def parse_pdb(pdb_file):
     """
@@ -68,14 +72,14 @@ def parse_pdb(pdb_file):
 
                 if current_residue is None:  # new residue
                     atoms = []
-                    current_residue = Residue(resnum, resname, atoms, current_chain, False, None)
+                    current_residue = Residue(resnum, resname, atoms, current_chain, False, None, residue_codes[resname])
                     current_chain.residues.append(current_residue)
                 
                 if current_residue.resnum != resnum:
                     if len(current_residue.atoms) > 1:
                         current_chain.residues.append(current_residue) 
                     atoms = []
-                    current_residue = Residue(resnum, resname, atoms, current_chain, False, None)
+                    current_residue = Residue(resnum, resname, atoms, current_chain, False, None, residue_codes[resname])
                                                                 
                 atomname = line[12:16].replace(" ", "")
                 if atomname == "OXT": # OXT is the C-terminal Oxygen atom. However, it exhibits the same properties of any Oxygen
@@ -205,14 +209,14 @@ def parse_pdbx(pdbx_file):
 
                 if current_residue is None:  # new residue
                     atoms = []
-                    current_residue = Residue(resnum, resname, atoms, current_chain, False, None)
+                    current_residue = Residue(resnum, resname, atoms, current_chain, False, None, residue_codes[resname])
                     current_chain.residues.append(current_residue)
                 
                 if current_residue.resnum != resnum:
                     if len(current_residue.atoms) > 1:
                         current_chain.residues.append(current_residue) 
                     atoms = []
-                    current_residue = Residue(resnum, resname, atoms, current_chain, False, None)
+                    current_residue = Residue(resnum, resname, atoms, current_chain, False, None, residue_codes[resname])
                     #current_chain.residues.append(current_residue)
                                                                 
                 atomname = line[atomname_index]
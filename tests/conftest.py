@@ -0,0 +1,20 @@
+import sys
+from os.path import dirname, join
+
+from pytest import fixture
+
+sys.path.insert(0, join(dirname(dirname(__file__)), "src"))
+
+data = join(dirname(__file__), "data")
+
+
+@fixture
+def structure_file():
+    # synthetic structure of 120 residues in chains A and B, with contacts of every category and aromatic stackings
+    return join(data, "synthetic.pdb")
+
+
+@fixture
+def ensemble_file():
+    # synthetic ensemble of 4 models of 40 residues
+    return join(data, "ensemble.pdb")
@@ -0,0 +1,18 @@
+import sys
+from os.path import dirname, join
+
+sys.path.insert(0, join(dirname(dirname(__file__)), "src"))
+
+import argparser
+
+
+def test_region_specs():
+    assert argparser.region_spec("A:10-50") == ("range", "A", 10, 50)
+    assert argparser.region_spec("B:7") == ("residue", "B", 7)
+    assert argparser.region_spec("-10,5,-3.5:4") == ("sphere", (-10.0, 5.0, -3.5), 4.0)
+
+
+def test_region_with_negative_centre(monkeypatch):
+    monkeypatch.setattr(argparser, "argv", ["main.py", "-pdb", "x.pdb", "-engine", "numba", "-region", "-10,5,3:4", "A:10-12", "-.5,1,2:6"])
+    region = argparser.cl_parse()[-2]
+    assert region == [("sphere", (-10.0, 5.0, 3.0), 4.0), ("range", "A", 10, 12), ("sphere", (-0.5, 1.0, 2.0), 6.0)]
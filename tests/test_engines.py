@@ -0,0 +1,78 @@
+from collections import Counter
+
+from pytest import mark
+
+import parser
+import contacts
+import occupancy
+
+engines = ["python", "grid", "kdtree", "tensor", "numba"]
+
+
+def values(found):
+    return [contact.print_values() for contact in found]
+
+
+def reference(structure_file, fast):
+    # nested loop of the python engine on the object parser
+    return contacts.contact_detection(parser.parse_pdb(structure_file), fast, {})[0]
+
+
+@mark.parametrize("fast", [True, False])
+@mark.parametrize("engine", engines)
+def test_engine_matches_reference(structure_file, engine, fast):
+    arrays = parser.parse_pdb_arrays(structure_file)
+    assert values(contacts.engines[engine](arrays, fast, {})[0]) == values(reference(structure_file, fast))
+
+
+@mark.parametrize("fast", [True, False])
+@mark.parametrize("engine", ["tensor", "numba"])
+def test_spheres(structure_file, engine, fast):
+    arrays = parser.parse_pdb_arrays(structure_file)
+    assert values(contacts.engines[engine](arrays, fast, {}, spheres=True)[0]) == values(reference(structure_file, fast))
+
+
+@mark.parametrize("categories", [["salt_bridge", "stacking"], ["hydrogen_bond", "hydrophobic"]])
+@mark.parametrize("engine", ["tensor", "numba"])
+def test_types(structure_file, engine, categories):
+    arrays = parser.parse_pdb_arrays(structure_file)
+    # -types overrides -fast, so both give the contacts of those categories among all of them
+    expected = [contact for contact in reference(structure_file, True)
+                if contact.type in categories or (contact.type.startswith("stacking") and "stacking" in categories)]
+    assert expected
+    for fast in (True, False):
+        assert values(contacts.engines[engine](arrays, fast, {}, categories=categories)[0]) == values(expected)
+
+
+@mark.parametrize("interface", [True, [("A", "B")], [("B", "A")]])
+@mark.parametrize("engine", ["tensor", "numba"])
+def test_interface(structure_file, engine, interface):
+    arrays = parser.parse_pdb_arrays(structure_file)
+    for fast in (True, False):
+        expected = [contact for contact in reference(structure_file, fast) if contact.chain1 != contact.chain2]
+        assert expected
+        assert values(contacts.engines[engine](arrays, fast, {}, interface=interface)[0]) == values(expected)
+
+
+@mark.parametrize("skin", [None, 2.0])
+@mark.parametrize("fast", [True, False])
+def test_ensemble_matches_models(ensemble_file, fast, skin):
+    ensemble = parser.parse_ensemble(ensemble_file)
+    expected = [values(contacts.contact_detection_tensor(ensemble.model(index), fast, {})[0]) for index in range(ensemble.model_count())]
+    assert [values(model) for model in contacts.ensemble_detection(ensemble, fast, {}, skin=skin)[0]] == expected
+
+
+@mark.parametrize("bitsets", [True, False])
+@mark.parametrize("fast", [True, False])
+def test_occupancy_counts(ensemble_file, fast, bitsets):
+    ensemble = parser.parse_ensemble(ensemble_file)
+    # frames of each contact, keyed like the summary rows: id, chains, atoms and type
+    expected = Counter()
+    for index in range(ensemble.model_count()):
+        for contact in contacts.contact_detection_tensor(ensemble.model(index), fast, {})[0]:
+            expected[(contact.id, contact.chain1, f"{contact.residue_num1}{contact.residue_name1}:{contact.atom1}",
+                      contact.chain2, f"{contact.residue_num2}{contact.residue_name2}:{contact.atom2}", contact.type)] += 1
+
+    table = occupancy.ensemble_occupancy(ensemble, fast, {}, bitsets=bitsets)[0]
+    assert table.frame_count == ensemble.model_count()
+    assert {tuple(row[:6]): row[6] for row in table.summary()} == expected
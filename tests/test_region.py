@@ -0,0 +1,15 @@
+import parser
+import contacts
+import region
+
+
+def test_sphere_includes_first_residue(structure_file):
+    arrays = parser.parse_pdb_arrays(structure_file)
+    query = region.RegionQuery(arrays, True)
+    selection = query.sphere(arrays.coords[0], 1) # only A:1, which the parser stores twice (rows 0 and 1)
+    keys = set(zip(arrays.chain_ids[arrays.residue_chain[selection]].tolist(), arrays.resnums[selection].tolist()))
+
+    reference = [contact for contact in contacts.contact_detection(parser.parse_pdb(structure_file), True, {})[0]
+                 if (contact.chain1, contact.residue_num1) in keys or (contact.chain2, contact.residue_num2) in keys]
+    assert any((contact.chain1, contact.residue_num1) == ("A", 1) for contact in reference)
+    assert [contact.print_values() for contact in query.contacts(selection)[0]] == [contact.print_values() for contact in reference]
@@ -0,0 +1,41 @@
+import sys
+from os.path import dirname, join
+
+from numpy import array, allclose
+
+sys.path.insert(0, join(dirname(dirname(__file__)), "src"))
+
+import parser
+
+# C-terminal TYR: the OXT comes after the 12 atoms the ring check counts
+tyrosine = [("N", -1.2, 1.1, 0.0), ("CA", 0.0, 1.5, 0.0), ("C", 0.5, 2.9, 0.0), ("O", 1.6, 3.2, 0.0), ("CB", 0.4, 0.3, 0.8),
+            ("CG", 0.4, -1.0, 0.1), ("CD1", 1.5, -1.5, -0.5), ("CD2", -0.7, -1.8, 0.1), ("CE1", 1.5, -2.7, -1.2),
+            ("CE2", -0.7, -3.0, -0.6), ("CZ", 0.4, -3.5, -1.2), ("OH", 0.4, -4.7, -1.9), ("OXT", -0.3, 3.8, 0.1)]
+alanine = [("N", -4.0, 0.0, 0.0), ("CA", -3.5, 1.3, 0.0), ("C", -2.0, 1.3, 0.0), ("O", -1.4, 2.3, 0.0), ("CB", -4.0, 2.1, 1.2)]
+glycine = [("N", 4.0, 0.0, 0.0), ("CA", 4.5, 1.3, 0.0), ("C", 6.0, 1.3, 0.0), ("O", 6.6, 2.3, 0.0)]
+
+
+def write_pdb(path):
+    lines = []
+    # the parser keeps a residue when the next one starts, so a chain B follows the C-terminal TYR of chain A
+    for chain, resnum, resname, atoms in (("A", 1, "ALA", alanine), ("A", 2, "TYR", tyrosine), ("B", 1, "GLY", glycine)):
+        for name, x, y, z in atoms:
+            lines.append(f"ATOM  {len(lines) + 1:5d} {name:<4s} {resname} {chain}{resnum:4d}    {x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00           {name[0]}")
+    lines.append("END")
+    path.write_text("\n".join(lines) + "\n")
+
+
+def test_oxt_keeps_ring(tmp_path):
+    path = tmp_path / "oxt.pdb"
+    write_pdb(path)
+    centroid = array([atom[1:] for atom in tyrosine[5:12]]).mean(axis=0)
+
+    residue = [residue for residue in parser.parse_pdb(str(path)).get_residues() if residue.resname == "TYR"][0]
+    assert residue.ring
+    assert residue.atoms[-1].atomname == "RNG"
+    assert allclose((residue.atoms[-1].x, residue.atoms[-1].y, residue.atoms[-1].z), centroid)
+
+    arrays = parser.parse_pdb_arrays(str(path))
+    row = arrays.resnums.tolist().index(2)
+    assert arrays.ring[row]
+    assert allclose(arrays.ring_centroids[row], centroid)